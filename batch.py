@@ -0,0 +1,218 @@
+# Command-line batch planning, without the HTTP server.
+#
+#   python batch.py "Data/SmartRoute Optimizer.xlsx" -o out/
+#   python batch.py stores/ -o out/ --format parquet --stores stores.csv
+#
+# Every input file is one store's day of shipments (.xlsx, .csv, .ndjson or
+# .jsonl; directories are searched recursively, globs are expanded). Files
+# are planned with the API's engine in a pool of worker processes and each
+# plan is written under the output directory at the input's relative path.
+import argparse
+import csv
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from clustering import ORDERINGS
+from fleet import fleet_config
+from ingest import COLUMN_ALIASES, read_file, read_store_location
+import planner
+
+INPUT_EXTENSIONS = ('.xlsx', '.xlsm', '.csv', '.ndjson', '.jsonl')
+OUTPUT_FORMATS = ('csv', 'parquet')
+
+
+def _glob_root(pattern):
+    # Leading directories of a pattern that hold no wildcards
+    parts = []
+    for part in os.path.dirname(pattern).split(os.sep):
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return os.sep.join(parts)
+
+
+def find_inputs(paths):
+    # [(path, path relative to the argument it came from)]
+    found = []
+    for arg in paths:
+        if os.path.isdir(arg):
+            for root, dirs, files in os.walk(arg):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(INPUT_EXTENSIONS) and not name.startswith('~$'):
+                        path = os.path.join(root, name)
+                        found.append((path, os.path.relpath(path, arg)))
+        elif glob.has_magic(arg):
+            root = _glob_root(arg)
+            for path in sorted(glob.glob(arg)):
+                if os.path.isfile(path):
+                    found.append((path, os.path.relpath(path, root or '.')))
+        else:
+            found.append((arg, os.path.basename(arg)))
+    return found
+
+
+def read_stores(path):
+    # {store name: (lat, lon)} from a CSV with store, latitude and longitude
+    # columns
+    stores = {}
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        rows = csv.reader(f)
+        header = [COLUMN_ALIASES.get(name.strip().lower().replace(' ', '_'), name.strip().lower())
+                  for name in next(rows, [])]
+        missing = [key for key in ('store', 'latitude', 'longitude') if key not in header]
+        if missing:
+            raise ValueError(f'{path}: missing columns: {", ".join(missing)}')
+        name, lat, lon = header.index('store'), header.index('latitude'), header.index('longitude')
+        for line_no, row in enumerate(rows, 2):
+            if not row:
+                continue
+            try:
+                stores[row[name].strip()] = (float(row[lat]), float(row[lon]))
+            except (ValueError, IndexError) as e:
+                raise ValueError(f'{path}: line {line_no}: {e}') from None
+    return stores
+
+
+def store_for(path, stores):
+    # A file belongs to the store named like its directory, or failing that
+    # like the file itself (stores/andheri/2024-05-01.csv, andheri.csv)
+    directory = os.path.basename(os.path.dirname(os.path.abspath(path)))
+    stem = os.path.splitext(os.path.basename(path))[0]
+    for name in (directory, stem):
+        if name in stores:
+            return (name,) + stores[name]
+    return None
+
+
+def write_rows(rows, path, fmt):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    frame = pd.DataFrame(rows)
+    tmp_path = path + '.tmp'
+    if fmt == 'parquet':
+        # COV_UTI is 'N/A' for unlimited-radius vehicles, a null here
+        if 'COV_UTI' in frame:
+            frame['COV_UTI'] = pd.to_numeric(frame['COV_UTI'], errors='coerce')
+        frame.to_parquet(tmp_path, index=False)
+    else:
+        frame.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def plan_file(path, output, fmt, fleet=None, store=None, local_search=None, ordering=None):
+    # Worker entry point. store is (id, lat, lon); a file with a known store
+    # is planned from it alone with the fleet's vehicles, otherwise from the
+    # fleet's own stores
+    start = time.perf_counter()
+    table = read_file(path)
+    if store is None and path.lower().endswith(('.xlsx', '.xlsm')):
+        location = read_store_location(path)
+        if location:
+            store = ('default',) + location
+    fleet = planner.request_fleet(fleet)
+    if store is not None:
+        fleet = fleet.with_store(*store)
+    route_plan, rows = planner.optimize_plan(table, local_search=local_search, ordering=ordering, fleet=fleet)
+    write_rows(rows, output, fmt)
+    planner.distance_cache.save(min_unsaved=planner.DISTANCE_CACHE_SAVE_EVERY)
+    return {
+        'shipments': len(table),
+        'planned_shipments': len(rows),
+        'trips': len(route_plan.trips),
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Plan shipment files in batch')
+    parser.add_argument('inputs', nargs='+', help='shipment files, directories or glob patterns')
+    parser.add_argument('-o', '--output-dir', required=True)
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='csv')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='files planned concurrently')
+    parser.add_argument('--fleet', help='JSON fleet configuration (vehicles, trip time model, stores)')
+    parser.add_argument('--stores', help='CSV of store, latitude, longitude; matched by directory or file name')
+    parser.add_argument('--store', help='LAT,LON for files no other store location applies to')
+    parser.add_argument('--ordering', choices=ORDERINGS, help=f'slot ordering (default {planner.SLOT_ORDERING})')
+    parser.add_argument('--local-search-ms', type=float, help='local search budget per file')
+    parser.add_argument('--inter-trip', action='store_true', help='let local search move stops between trips')
+    parser.add_argument('--no-local-search', action='store_true')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=os.environ.get('SMARTROUTE_LOG_LEVEL', 'WARNING'))
+
+    default_store = None
+    if args.store:
+        try:
+            lat, lon = (float(v) for v in args.store.split(','))
+        except ValueError:
+            parser.error(f'--store must be LAT,LON, got {args.store!r}')
+        default_store = ('default', lat, lon)
+    fleet = None
+    try:
+        stores = read_stores(args.stores) if args.stores else {}
+        if args.fleet:
+            with open(args.fleet) as f:
+                fleet = json.load(f)
+            fleet_config(fleet)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    if args.no_local_search:
+        local_search = False
+    else:
+        local_search = {'inter_trip': args.inter_trip or planner.LOCAL_SEARCH_INTER_TRIP}
+        if args.local_search_ms is not None:
+            local_search['budget_ms'] = args.local_search_ms
+
+    inputs = find_inputs(args.inputs)
+    if not inputs:
+        parser.error('no input files found')
+    tasks = []
+    outputs = {}
+    for path, relative in inputs:
+        output = os.path.join(args.output_dir, os.path.splitext(relative)[0] + '.' + args.format)
+        if output in outputs:
+            parser.error(f'{path} and {outputs[output]} would both be written to {output}')
+        outputs[output] = path
+        tasks.append((path, output, args.format, fleet, store_for(path, stores) or default_store, local_search,
+                       args.ordering))
+
+    failures = 0
+
+    def report(task, result=None, error=None):
+        nonlocal failures
+        if error is not None:
+            failures += 1
+            print(f'FAILED {task[0]}: {error}', file=sys.stderr)
+        else:
+            print(f"{task[0]} -> {task[1]}: {result['planned_shipments']}/{result['shipments']} shipments "
+                  f"in {result['trips']} trips, {result['seconds']:.2f}s")
+
+    start = time.perf_counter()
+    if args.workers <= 1 or len(tasks) == 1:
+        for task in tasks:
+            try:
+                report(task, plan_file(*task))
+            except Exception as e:
+                report(task, error=e)
+    else:
+        with ProcessPoolExecutor(max_workers=min(args.workers, len(tasks))) as pool:
+            futures = {pool.submit(plan_file, *task): task for task in tasks}
+            for future in as_completed(futures):
+                try:
+                    report(futures[future], future.result())
+                except Exception as e:
+                    report(futures[future], error=e)
+    planner.distance_cache.save()
+    print(f'{len(tasks) - failures}/{len(tasks)} files planned in {time.perf_counter() - start:.2f}s')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,236 @@
+# Correctness checks run by `benchmarks/run.py --check` next to the plan
+# quality comparison, for the parts of the planner whose mistakes would not
+# show up in the quality metrics. Every check is deterministic and returns
+# a list of failure messages.
+import heapq
+import os
+import tempfile
+
+import numpy as np
+
+import workloads
+from distance import haversine_pairs, haversine_rect
+from distance_cache import point_keys
+
+
+def _dijkstra(n, edges, source):
+    adj = [[] for _ in range(n)]
+    for a, b, w in edges:
+        adj[int(a)].append((int(b), w))
+        adj[int(b)].append((int(a), w))
+    dist = np.full(n, np.inf)
+    dist[source] = 0
+    heap = [(0.0, source)]
+    while heap:
+        d, x = heapq.heappop(heap)
+        if d > dist[x]:
+            continue
+        for y, w in adj[x]:
+            if d + w < dist[y]:
+                dist[y] = d + w
+                heapq.heappush(heap, (d + w, y))
+    return dist
+
+
+def _street_grid(rng, side, spacing_km=0.25, missing=0.25):
+    # Jittered grid of junctions around the store with a share of its
+    # streets missing and the rest longer than the straight line
+    dy, dx = np.divmod(np.arange(side * side), side)
+    dx = (dx - side / 2 + rng.uniform(-0.3, 0.3, dx.size)) * spacing_km
+    dy = (dy - side / 2 + rng.uniform(-0.3, 0.3, dy.size)) * spacing_km
+    lat = workloads.STORE_LAT + dy / workloads.KM_PER_DEGREE
+    lon = workloads.STORE_LON + dx / (workloads.KM_PER_DEGREE * np.cos(np.radians(workloads.STORE_LAT)))
+    nodes = np.arange(side * side).reshape(side, side)
+    u = np.concatenate([nodes[:, :-1].ravel(), nodes[:-1, :].ravel()])
+    v = np.concatenate([nodes[:, 1:].ravel(), nodes[1:, :].ravel()])
+    keep = rng.random(u.size) >= missing
+    u, v = u[keep], v[keep]
+    km = haversine_pairs(lat[u], lon[u], lat[v], lon[v]) * rng.uniform(1, 1.5, u.size)
+    return lat, lon, np.column_stack((u, v, km))
+
+
+def road_graph_matches_dijkstra(seed=0, side=24, sources=8, targets=40):
+    # The contraction hierarchy's point-to-point, many-to-many and one-to-all
+    # km against plain Dijkstra on the same graph, and RoadDistances (snap,
+    # road, snap) before and after its slot table is written
+    from road_graph import MAX_SNAP_KM, RoadDistances, RoadGraph, contract
+
+    rng = np.random.default_rng(seed)
+    lat, lon, edges = _street_grid(rng, side)
+    n = len(lat)
+    graph = RoadGraph(lat, lon, *contract(n, edges))
+    failures = []
+
+    origins = rng.choice(n, size=sources, replace=False).tolist()
+    ends = rng.choice(n, size=targets, replace=False).tolist()
+    expected = {source: _dijkstra(n, edges, source) for source in origins}
+    table = graph.many_to_many(origins, ends)
+    queries = {
+        'distance()': lambda i, source: (np.asarray([graph.distance(source, end) for end in ends]),
+                                         expected[source][ends]),
+        'many_to_many()': lambda i, source: (table[i], expected[source][ends]),
+        'one_to_all()': lambda i, source: (graph.one_to_all(source), expected[source]),
+    }
+    for name, query in queries.items():
+        wrong = sum(not np.allclose(*query(i, source), rtol=1e-9, atol=1e-9) for i, source in enumerate(origins))
+        if wrong:
+            failures.append(f'road graph: {name} differs from Dijkstra from {wrong} of {sources} nodes')
+
+    # Shipments between the junctions, one of them twice and one far off
+    # the network, which falls back to a straight line
+    half = side * 0.25 / 2 / workloads.KM_PER_DEGREE
+    lats = workloads.STORE_LAT + rng.uniform(-half, half, targets)
+    lons = workloads.STORE_LON + rng.uniform(-half, half, targets)
+    lats[1], lons[1] = lats[0], lons[0]
+    lats[-1], lons[-1] = workloads.STORE_LAT + 0.2, workloads.STORE_LON + 0.2
+    to_node = haversine_rect(lats, lons, lat, lon)
+    nodes = to_node.argmin(axis=1)
+    snap = to_node[np.arange(targets), nodes]
+    road = np.stack([_dijkstra(n, edges, node) for node in nodes.tolist()])[:, nodes]
+    ref = snap[:, None] + road + snap[None, :]
+    off = (snap > MAX_SNAP_KM)[:, None] | (snap > MAX_SNAP_KM)[None, :] | ~np.isfinite(ref)
+    ref = np.where(off, haversine_rect(lats, lons, lats, lons), ref)
+    keys = point_keys(lats, lons)
+    ref[keys[:, None] == keys[None, :]] = 0
+
+    with tempfile.TemporaryDirectory(prefix='smartroute-check-') as directory:
+        graph.save(os.path.join(directory, 'graph'))
+        provider = RoadDistances(os.path.join(directory, 'graph'), os.path.join(directory, 'tables'))
+        rows, cols = np.triu_indices(targets)
+        if not np.allclose(provider.pairs(lats[rows], lons[rows], lats[cols], lons[cols]), ref[rows, cols],
+                           rtol=1e-9, atol=1e-9):
+            failures.append('road distances: pairs() differs from snap + Dijkstra + snap')
+        if not np.allclose(provider.rect(lats, lons, lats, lons), ref, rtol=1e-9, atol=1e-9):
+            failures.append('road distances: rect() differs from snap + Dijkstra + snap')
+        if provider.prepare([(lats, lons)]) != 1:
+            failures.append('road distances: prepare() did not write the slot table')
+        if not np.allclose(provider.rect(lats, lons, lats, lons), ref, rtol=1e-6, atol=1e-6):
+            failures.append('road distances: the prepared table differs from snap + Dijkstra + snap')
+    return failures
+
+
+def _trips(rows, slots=None):
+    # Stored rows without the trip numbers, which shift when an earlier
+    # slot gains or loses a trip
+    return [{key: value for key, value in row.items() if key != 'TRIP_ID'}
+            for row in rows if slots is None or row['TIME_SLOT'] not in slots]
+
+
+def replan_matches_full_plan(seed=0, n=300, steps=16):
+    # Shipment adds, removals and moves applied with replan_shipments() to a
+    # day that leaves vehicles to spare: each step keeps the trips of the
+    # slots it did not re-solve and ends with the plan a full optimization
+    # of the changed day gives. Local search is off, as its budget is
+    # wall-clock time
+    import new
+    from planner import optimize_routes
+
+    rng = np.random.default_rng(seed)
+    slots = [slot for slot, _ in workloads.TIMESLOTS]
+    day = {shipment['shipment_id']: shipment for shipment in workloads.generate(n, seed=seed)}
+    new.optimize_and_store(list(day.values()), plan='check-replan', local_search=False)
+    failures = []
+    for step in range(steps):
+        ids = sorted(day)
+        add = [dict(shipment, shipment_id=f'A{step}_{i}')
+               for i, shipment in enumerate(workloads.generate(2, seed=seed + step + 1))]
+        remove = rng.choice(ids, size=2, replace=False).tolist()
+        moved = rng.choice([i for i in ids if i not in remove]).item()
+        if step % 2:
+            move = [{'shipment_id': moved, 'delivery_timeslot': slots[int(rng.integers(len(slots)))]}]
+        else:
+            move = [{'shipment_id': moved, 'latitude': day[moved]['latitude'] + 0.003}]
+        changes = ({'add': add}, {'remove': remove}, {'move': move},
+                   {'add': add, 'remove': remove, 'move': move})[step % 4]
+
+        for shipment_id in changes.get('remove', ()):
+            del day[shipment_id]
+        for change in changes.get('move', ()):
+            day[change['shipment_id']] = dict(day[change['shipment_id']], **change)
+        for shipment in changes.get('add', ()):
+            day[shipment['shipment_id']] = shipment
+
+        before = new.trip_store.get('check-replan').rows
+        result = new.replan_shipments('check-replan', local_search=False, **changes)
+        after = new.trip_store.get('check-replan').rows
+        resolved = set(result['resolved_slots'])
+        if _trips(before, resolved) != _trips(after, resolved):
+            failures.append(f'replan step {step} ({", ".join(changes)}): trips of slots it did not re-solve changed')
+        if _trips(after) != _trips(optimize_routes(list(day.values()), local_search=False)):
+            failures.append(f'replan step {step} ({", ".join(changes)}): plan differs from a full re-optimization')
+        if failures:
+            # Later steps would start from the wrong plan
+            break
+    return failures
+
+
+def local_search_invariants(seed=0, days=(0, 1, 2), n=300, budget=60):
+    # 2-opt/Or-opt must return a reordering of the tour that is no longer,
+    # and inter-trip moves must keep every shipment planned exactly once in
+    # trips that still fit their vehicle (capacity, radius, slot time and
+    # minimum load), with tour km not above the tours they started from.
+    # The budget is far more than needed, so both run to a local optimum
+    import math
+    import time
+
+    from distance import haversine_matrix
+    from local_search import improve_tour, tour_length
+    from planner import compute_mst, improve_trips, optimize_plan
+
+    rng = np.random.default_rng(seed)
+    failures = []
+    for k in (4, 9, 25, 80):
+        lats = workloads.STORE_LAT + rng.normal(0, 0.05, k)
+        lons = workloads.STORE_LON + rng.normal(0, 0.05, k)
+        dist = haversine_matrix(lats, lons)
+        start = [0] + (1 + rng.permutation(k - 1)).tolist()
+        tour, length = improve_tour(dist, list(start), time.perf_counter() + budget)
+        if tour[0] != 0 or sorted(tour) != sorted(start):
+            failures.append(f'improve_tour: {k}-node tour is not a reordering starting at the store')
+        elif abs(length - tour_length(dist, tour)) > 1e-9 or length > tour_length(dist, start) + 1e-9:
+            failures.append(f'improve_tour: {k}-node tour got longer or misreports its length')
+
+    def points(table, trip):
+        return [trip.store.location] + list(zip(table.lat[trip.shipments].tolist(),
+                                                table.lon[trip.shipments].tolist()))
+
+    def tour_km(table, trip):
+        lats, lons = np.asarray(points(table, trip)).T
+        return tour_length(haversine_matrix(lats, lons), list(range(len(trip) + 1)))
+
+    # Days whose inter-trip moves shrink some trips towards the minimum load
+    for day in days:
+        route_plan, _ = optimize_plan(workloads.generate(n, seed=day), local_search=False)
+        table, trips = route_plan.shipments, list(route_plan.trips)
+        before = {id(trip): list(trip.shipments) for trip in trips}
+        before_km = sum(tour_km(table, trip) for trip in trips)
+        kept = improve_trips(trips, table, budget, inter_trip=True)
+        planned = sorted(row for trip in kept for row in trip.shipments)
+        if planned != sorted(row for rows in before.values() for row in rows):
+            failures.append(f'inter-trip moves (day {day}): shipments were lost or planned twice')
+        if sum(tour_km(table, trip) for trip in kept) > before_km + 1e-6:
+            failures.append(f'inter-trip moves (day {day}): total tour km grew')
+        for trip in kept:
+            mst_dist = compute_mst(points(table, trip))
+            floor = math.ceil(trip.vehicle_capacity * trip.fleet.min_load)
+            broken = [name for name, bad in (
+                ('capacity', len(trip) > trip.vehicle_capacity),
+                ('minimum load', len(trip) < min(len(before[id(trip)]), floor)),
+                ('radius', mst_dist > trip.vehicle_max_radius + 1e-9),
+                ('slot time', trip.fleet.trip_time(mst_dist, len(trip)) > trip.end - trip.start + 1e-9),
+                ('reported mst km', abs(mst_dist - trip.mst_dist) > 1e-6),
+                ('reported tour km', abs(tour_km(table, trip) - trip.tour_dist) > 1e-6),
+            ) if bad]
+            if broken:
+                failures.append(f'inter-trip moves (day {day}): a {trip.vehicle} trip breaks its {", ".join(broken)}')
+    return failures
+
+
+CHECKS = (road_graph_matches_dijkstra, replan_matches_full_plan, local_search_invariants)
+
+
+def run():
+    failures = []
+    for check in CHECKS:
+        failures.extend(check())
+    return failures
@@ -0,0 +1,265 @@
+# Benchmark suite for the optimizer and the HTTP API.
+#
+#   python benchmarks/run.py                       # 100, 1k and 10k shipments
+#   python benchmarks/run.py --sizes 100k          # the big one
+#   python benchmarks/run.py --check               # fail if plan quality regressed or a check fails
+#   python benchmarks/run.py --update-baseline     # record current plan quality
+#
+# Every workload is generated from a fixed seed, so plan-quality metrics are
+# exactly reproducible and are compared against benchmarks/baseline.json.
+# --check also runs the correctness checks in benchmarks/checks.py.
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+# Keep the API's plan files out of the working tree
+os.environ.setdefault('SMARTROUTE_PLAN_DIR', tempfile.mkdtemp(prefix='smartroute-bench-'))
+
+import checks  # noqa: E402
+import workloads  # noqa: E402
+from instrumentation import metrics  # noqa: E402
+
+BASELINE_PATH = os.path.join(HERE, 'baseline.json')
+
+# Plan-quality metrics checked against the baseline: (direction, slack).
+# 'min' metrics regress when they drop, 'max' metrics when they grow.
+# Distance is checked per planned shipment, so planning more shipments does
+# not read as a regression, nor dropping some as an improvement.
+QUALITY_CHECKS = {
+    'planned_shipments': ('min', 0),
+    'avg_capacity_uti': ('min', 0.005),
+    'overtime_trips': ('max', 0),
+    'tour_km_per_shipment': ('max', 0.01),
+    'mst_updates_per_shipment': ('max', 0.05),
+    'feasibility_checks_per_shipment': ('max', 0.05),
+}
+
+# compute_mst and tsp_nearest_neighbor build a dense matrix, keep their
+# large-input case bounded
+MST_MAX_POINTS = 2000
+
+
+def quiet():
+    # Keep any stray output out of the report
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def timed(fn, repeat=1):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def plan_quality(shipments, rows):
+    trips = {}
+    for row in rows:
+        trips.setdefault(row['TRIP_ID'], row)
+    by_vehicle = {}
+    for row in trips.values():
+        by_vehicle[row['Vehicle_Type']] = by_vehicle.get(row['Vehicle_Type'], 0) + 1
+    return {
+        'shipments': len(shipments),
+        'planned_shipments': len(rows),
+        'trips': len(trips),
+        'trips_by_vehicle': dict(sorted(by_vehicle.items())),
+        'shipments_per_trip': round(len(rows) / len(trips), 4) if trips else 0,
+        'avg_capacity_uti': round(float(np.mean([r['CAPACITY_UTI'] for r in trips.values()])), 4) if trips else 0,
+        'avg_time_uti': round(float(np.mean([r['TIME_UTI'] for r in trips.values()])), 4) if trips else 0,
+        'overtime_trips': sum(1 for r in trips.values() if r['TIME_UTI'] > 1),
+        'mst_km': round(sum(r['MST_DIST'] for r in trips.values()), 2),
+        'tour_km': round(sum(r['TOUR_DIST'] for r in trips.values()), 2),
+        'tour_km_per_shipment': round(sum(r['TOUR_DIST'] for r in trips.values()) / len(rows), 4) if rows else 0,
+    }
+
+
+def batching_work(counters, shipments):
+    # Batching work per shipment: deterministic, unlike its wall-clock time.
+    # Updating the MST of a batch that had already outgrown every vehicle,
+    # once per shipment, took the 10k day from 0.1 s to over a minute
+    def per_shipment(name):
+        total = sum(value for (key, _), value in counters.items() if key == name)
+        return round(total / len(shipments), 4) if shipments else 0
+
+    return {
+        'mst_updates_per_shipment': per_shipment('smartroute_mst_updates_total'),
+        'feasibility_checks_per_shipment': per_shipment('smartroute_feasibility_checks_total'),
+    }
+
+
+def bench_kernels(planner, shipments, repeat):
+    rng = np.random.default_rng(1)
+    points = [planner.DEFAULT_FLEET.stores[0].location] + [(s['latitude'], s['longitude']) for s in shipments]
+    results = {}
+    for k in (5, 8, 25, min(MST_MAX_POINTS, len(points))):
+        sample = [points[0]] + [points[i] for i in rng.choice(np.arange(1, len(points)), size=min(k, len(points) - 1),
+                                                              replace=False)]
+        results[f'compute_mst[{len(sample)}]'], _ = timed(lambda: planner.compute_mst(sample), repeat)
+        results[f'tsp_nearest_neighbor[{len(sample)}]'], _ = timed(lambda: planner.tsp_nearest_neighbor(sample), repeat)
+    return results
+
+
+def bench_http(shipments):
+    from fastapi.testclient import TestClient
+
+    import new
+
+    client = TestClient(new.app)
+    results = {}
+    with quiet():
+        results['POST /optimize'], response = timed(lambda: client.post('/optimize', json={'shipments': shipments}))
+    response.raise_for_status()
+    results['GET /api/trips'], _ = timed(lambda: client.get('/api/trips'), 3)
+    for mode in new.MAP_MODES:
+        results[f'GET /api/all-trips-map?mode={mode} (cold)'], _ = timed(
+            lambda: client.get(f'/api/all-trips-map?mode={mode}'))
+        results[f'GET /api/all-trips-map?mode={mode} (cached)'], _ = timed(
+            lambda: client.get(f'/api/all-trips-map?mode={mode}'), 3)
+    rows = response.json()
+    if rows:
+        trip_id = rows[0]['TRIP_ID']
+        results['GET /api/map/{trip_id}'], _ = timed(lambda: client.get(f'/api/map/{trip_id}'))
+    return results
+
+
+def run_size(planner, label, args):
+    shipments = workloads.generate(workloads.SIZES[label], seed=args.seed)
+    report = {'size': label}
+
+    before = metrics.snapshot()
+    with quiet():
+        elapsed, rows = timed(lambda: planner.optimize_routes(shipments))
+    report['optimize_routes'] = elapsed
+    counters, _ = metrics.delta(before)
+    if args.parallel or args.check:
+        with quiet():
+            report['optimize_routes(parallel)'], parallel_rows = timed(
+                lambda: planner.optimize_routes(shipments, parallel=True))
+        report['parallel_matches_serial'] = parallel_rows == rows
+    if args.memory:
+        with quiet():
+            report['optimize_routes peak bytes'] = peak_memory(lambda: planner.optimize_routes(shipments))
+
+    report['quality'] = plan_quality(shipments, rows)
+    report['quality'].update(batching_work(counters, shipments))
+    report['kernels'] = bench_kernels(planner, shipments, args.repeat)
+    if args.http:
+        report['http'] = bench_http(shipments)
+    return report
+
+
+def check_quality(reports, baseline):
+    failures = []
+    for report in reports:
+        if report.get('parallel_matches_serial') is False:
+            failures.append(f"{report['size']}: optimize_routes(parallel=True) differs from the serial plan")
+        expected = baseline.get(report['size'])
+        if not expected:
+            continue
+        for metric, (direction, slack) in QUALITY_CHECKS.items():
+            if metric not in expected:
+                continue
+            value = report['quality'][metric]
+            if direction == 'min' and value < expected[metric] - slack:
+                failures.append(f"{report['size']}: {metric} {value} < baseline {expected[metric]}")
+            elif direction == 'max' and value > expected[metric] + slack:
+                failures.append(f"{report['size']}: {metric} {value} > baseline {expected[metric]}")
+    return failures
+
+
+def print_report(report):
+    print(f"== {report['size']} shipments ==")
+    for key, value in report.items():
+        if key in ('size', 'quality', 'kernels', 'http'):
+            continue
+        if key.endswith('bytes'):
+            print(f'  {key:<48} {value / 2**20:10.1f} MB')
+        elif isinstance(value, float):
+            print(f'  {key:<48} {value * 1000:10.1f} ms')
+        else:
+            print(f'  {key:<48} {value}')
+    for section in ('kernels', 'http'):
+        for key, value in report.get(section, {}).items():
+            print(f'  {key:<48} {value * 1000:10.2f} ms')
+    for key, value in report['quality'].items():
+        print(f'  quality.{key:<40} {value}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='SmartRoute optimizer benchmarks')
+    parser.add_argument('--sizes', default='100,1k,10k', help=f'comma separated, from {",".join(workloads.SIZES)}')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5, help='repetitions for the kernel timings')
+    parser.add_argument('--parallel', action='store_true', help='also time optimize_routes(parallel=True)')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='skip the tracemalloc pass')
+    parser.add_argument('--no-http', dest='http', action='store_false', help='skip the HTTP endpoint timings')
+    parser.add_argument('--check', action='store_true',
+                        help='exit non-zero if plan quality is below the baseline or the parallel plan differs')
+    parser.add_argument('--update-baseline', action='store_true', help='write current plan quality as the baseline')
+    parser.add_argument('--json', help='also write the full report to this file')
+    args = parser.parse_args(argv)
+
+    sizes = [size.strip() for size in args.sizes.split(',') if size.strip()]
+    unknown = [size for size in sizes if size not in workloads.SIZES]
+    if unknown:
+        parser.error(f'unknown sizes: {", ".join(unknown)}')
+
+    import planner
+
+    reports = []
+    for label in sizes:
+        report = run_size(planner, label, args)
+        print_report(report)
+        reports.append(report)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+
+    if args.update_baseline:
+        baseline.update({report['size']: report['quality'] for report in reports})
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    failures = check_quality(reports, baseline)
+    for failure in failures:
+        print(f'QUALITY REGRESSION {failure}')
+    if args.check:
+        broken = checks.run()
+        for failure in broken:
+            print(f'CHECK FAILED {failure}')
+        failures += broken
+    return 1 if args.check and failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+# Reproducible synthetic shipment days around the store.
+#
+# Delivery points follow the shape of Data/SmartRoute Optimizer.xlsx: centred
+# on STORE_LAT/STORE_LON, elongated north-south (about 7.8 km by 5.2 km
+# standard deviation) with a share of the demand packed into a few dense
+# neighbourhood hotspots. Timeslots follow the same file's mix.
+import numpy as np
+
+STORE_LAT = 19.075887
+STORE_LON = 72.877911
+
+SIZES = {'100': 100, '1k': 1_000, '10k': 10_000, '100k': 100_000}
+
+# (timeslot, share of shipments)
+TIMESLOTS = [
+    ('07:00:00-09:30:00', 0.35),
+    ('09:30:00-12:00:00', 0.56),
+    ('12:00:00-14:30:00', 0.09),
+]
+
+KM_PER_DEGREE = 111.32
+
+# Standard deviation (east-west, north-south) of the delivery spread, and of
+# the points around a hotspot centre
+SPREAD_KM = np.array([5.2, 7.8])
+HOTSPOT_KM = 0.8
+
+
+def generate(n, seed=0, hotspots=6, hotspot_share=0.3):
+    # -> list of /optimize payload dicts
+    rng = np.random.default_rng(seed)
+
+    dx = rng.normal(0, SPREAD_KM[0], size=n)
+    dy = rng.normal(0, SPREAD_KM[1], size=n)
+
+    # Part of the demand clusters around a handful of neighbourhoods
+    centres = rng.normal(0, 1, size=(hotspots, 2)) * SPREAD_KM
+    in_hotspot = rng.random(n) < hotspot_share
+    which = rng.integers(0, hotspots, size=n)
+    dx = np.where(in_hotspot, centres[which, 0] + rng.normal(0, HOTSPOT_KM, n), dx)
+    dy = np.where(in_hotspot, centres[which, 1] + rng.normal(0, HOTSPOT_KM, n), dy)
+
+    lat = STORE_LAT + dy / KM_PER_DEGREE
+    lon = STORE_LON + dx / (KM_PER_DEGREE * np.cos(np.radians(STORE_LAT)))
+
+    labels = [slot for slot, _ in TIMESLOTS]
+    shares = np.array([share for _, share in TIMESLOTS])
+    slots = rng.choice(len(labels), size=n, p=shares / shares.sum())
+
+    return [
+        {'shipment_id': f'S{i:06d}', 'latitude': round(la, 6), 'longitude': round(lo, 6),
+         'delivery_timeslot': labels[s]}
+        for i, (la, lo, s) in enumerate(zip(lat.tolist(), lon.tolist(), slots.tolist()))
+    ]
+
+
+def to_ndjson(shipments):
+    import json
+    return '\n'.join(json.dumps(s) for s in shipments).encode()
@@ -0,0 +1,35 @@
+# Spatial ordering of a time slot's shipments before batching.
+#
+# sweep_order walks the shipments by bearing around the store, starting
+# after the widest empty sector, nearer shipments first at equal bearings.
+# Consecutive shipments are then close together, so the sequential batcher
+# builds compact groups instead of mixing far-apart addresses.
+import numpy as np
+
+ORDERINGS = ('sweep', 'arrival')
+
+
+def sweep_order(lats, lons, origin):
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    n = lats.size
+    if n < 2:
+        return np.arange(n)
+    lat0, lon0 = origin
+    # Equirectangular projection around the store, plenty for bearings
+    # within a city
+    x = (lons - lon0) * np.cos(np.radians(lat0))
+    y = lats - lat0
+    angle = np.arctan2(y, x)
+    order = np.lexsort((np.arange(n), np.hypot(x, y), angle))
+    gaps = np.diff(np.r_[angle[order], angle[order[0]] + 2 * np.pi])
+    return np.roll(order, -((int(np.argmax(gaps)) + 1) % n))
+
+
+def order_groups(table, groups, origin, ordering='sweep'):
+    # Reorders the row indices of every slot from timeslot_groups
+    if ordering not in ORDERINGS:
+        raise ValueError(f'Unknown ordering: {ordering!r}')
+    if ordering == 'arrival':
+        return groups
+    return {key: rows[sweep_order(table.lat[rows], table.lon[rows], origin)] for key, rows in groups.items()}
@@ -0,0 +1,95 @@
+# Vectorized haversine kernels.
+#
+# All functions take latitude/longitude in degrees (anything np.asarray
+# accepts) and return distances in km. Pass dtype=np.float32 to compute and
+# store the result in single precision, which halves the memory of large
+# matrices at the cost of about a metre of accuracy.
+#
+# HaversineDistances is the default distance provider. A provider measures
+# km with to_point, pairs and rect (the signatures of the kernels below) and
+# may precompute with prepare(point_sets) the distances within each set;
+# road_graph.RoadDistances is the road network one.
+import numpy as np
+
+from instrumentation import metrics
+
+EARTH_RADIUS_KM = 6371
+
+# Rows of the output computed per pass in haversine_rect, bounds the size of
+# the temporaries for very large matrices
+BLOCK_ROWS = 1024
+
+
+def _as_radians(values, dtype):
+    return np.radians(np.asarray(values, dtype=dtype))
+
+
+def _count(pairs):
+    metrics.inc('smartroute_haversine_calls_total')
+    metrics.inc('smartroute_haversine_pairs_total', pairs)
+
+
+def _haversine(lat1, cos1, lon1, lat2, cos2, lon2):
+    a = np.sin((lat2 - lat1) / 2) ** 2 + cos1 * cos2 * np.sin((lon2 - lon1) / 2) ** 2
+    return EARTH_RADIUS_KM * (2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a)))
+
+
+def haversine_to_point(lats, lons, lat, lon, dtype=np.float64):
+    # Distance from every (lats[i], lons[i]) to a single point
+    lat1 = _as_radians(lats, dtype)
+    lon1 = _as_radians(lons, dtype)
+    _count(lat1.size)
+    lat2 = _as_radians(lat, dtype)
+    lon2 = _as_radians(lon, dtype)
+    return _haversine(lat1, np.cos(lat1), lon1, lat2, np.cos(lat2), lon2).astype(dtype, copy=False)
+
+
+def haversine_rect(lats_a, lons_a, lats_b, lons_b, dtype=np.float64):
+    # out[i, j] is the distance from point i of set a to point j of set b
+    lat_a = _as_radians(lats_a, dtype)
+    lon_a = _as_radians(lons_a, dtype)
+    lat_b = _as_radians(lats_b, dtype)
+    lon_b = _as_radians(lons_b, dtype)
+    _count(lat_a.size * lat_b.size)
+    cos_a = np.cos(lat_a)[:, None]
+    cos_b = np.cos(lat_b)[None, :]
+
+    out = np.empty((lat_a.size, lat_b.size), dtype=dtype)
+    for lo in range(0, lat_a.size, BLOCK_ROWS):
+        hi = lo + BLOCK_ROWS
+        out[lo:hi] = _haversine(
+            lat_a[lo:hi, None], cos_a[lo:hi], lon_a[lo:hi, None],
+            lat_b[None, :], cos_b, lon_b[None, :],
+        )
+    return out
+
+
+def haversine_pairs(lats_a, lons_a, lats_b, lons_b, dtype=np.float64):
+    # Distance from (lats_a[i], lons_a[i]) to (lats_b[i], lons_b[i]) for every i
+    lat_a = _as_radians(lats_a, dtype)
+    lon_a = _as_radians(lons_a, dtype)
+    lat_b = _as_radians(lats_b, dtype)
+    lon_b = _as_radians(lons_b, dtype)
+    _count(lat_a.size)
+    return _haversine(lat_a, np.cos(lat_a), lon_a, lat_b, np.cos(lat_b), lon_b).astype(dtype, copy=False)
+
+
+def haversine_matrix(lats, lons, dtype=np.float64):
+    # Full pairwise matrix of one point set
+    return haversine_rect(lats, lons, lats, lons, dtype=dtype)
+
+
+def points_to_arrays(points, dtype=np.float64):
+    # [(lat, lon), ...] -> (lats, lons)
+    arr = np.asarray(points, dtype=dtype).reshape(-1, 2)
+    return arr[:, 0], arr[:, 1]
+
+
+class HaversineDistances:
+    name = 'haversine'
+    to_point = staticmethod(haversine_to_point)
+    pairs = staticmethod(haversine_pairs)
+    rect = staticmethod(haversine_rect)
+
+    def prepare(self, point_sets):
+        return 0
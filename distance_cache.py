@@ -0,0 +1,223 @@
+# Process-wide cache of point-to-point distances.
+#
+# Points are keyed by their coordinates quantized to QUANTUM degrees (about
+# 10 cm), so a re-submitted address hits the distances computed for it
+# before. The memory tier is an LRU of unordered point pairs bounded by
+# entry count. save() merges it into an optional disk tier, one sorted
+# record file opened with np.load(mmap_mode='r') and searched in bulk, so
+# distances between recurring customer addresses survive restarts without
+# being read into memory.
+#
+# Misses are measured by the cache's distance provider (haversine unless
+# given another, see distance.py), and each provider has its own disk file.
+# Several processes may save to the same file; each save merges with the
+# file as it is then, under a lock.
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from distance import HaversineDistances
+from file_lock import locked
+from instrumentation import metrics
+
+QUANTUM = 1e-6
+
+# Quantized latitudes fit in 28 bits and longitudes in 29, so a point key
+# fits in 57 bits and a pair key is (low << 57) | high
+_LON_BITS = 29
+_POINT_BITS = 57
+
+# Longer rows and larger matrices skip the cache; the vectorized kernels
+# beat per-pair lookups there and caching them would flush the LRU
+MAX_ROW = 256
+
+# Multipliers for the 64-bit pair hash the disk tier is sorted by
+_HASH_A = np.uint64(0x9E3779B97F4A7C15)
+_HASH_B = np.uint64(0xC2B2AE3D27D4EB4F)
+
+DISK_DTYPE = np.dtype([('hash', '<u8'), ('a', '<i8'), ('b', '<i8'), ('km', '<f8')])
+DISK_FILE = 'distances.npy'
+
+
+def point_key(lat, lon):
+    return (round((lat + 90) / QUANTUM) << _LON_BITS) | round((lon + 180) / QUANTUM)
+
+
+def point_keys(lats, lons):
+    lat_q = np.rint((np.asarray(lats, dtype=np.float64) + 90) / QUANTUM).astype(np.int64)
+    lon_q = np.rint((np.asarray(lons, dtype=np.float64) + 180) / QUANTUM).astype(np.int64)
+    return (lat_q << _LON_BITS) | lon_q
+
+
+def _pair_hash(a, b):
+    a = np.asarray(a, dtype=np.int64).astype(np.uint64)
+    b = np.asarray(b, dtype=np.int64).astype(np.uint64)
+    return (a * _HASH_A) ^ (b * _HASH_B)
+
+
+class DistanceCache:
+    def __init__(self, max_entries=1_000_000, directory=None, max_disk_entries=20_000_000, provider=None):
+        self.provider = provider or HaversineDistances()
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.unsaved = 0
+        disk_file = DISK_FILE if self.provider.name == 'haversine' else f'distances-{self.provider.name}.npy'
+        self.path = os.path.join(directory, disk_file) if directory else None
+        self.disk = None
+        if self.path and os.path.exists(self.path):
+            self.disk = np.load(self.path, mmap_mode='r')
+
+    def to_point(self, lats, lons, lat, lon):
+        # Drop-in for distance.haversine_to_point
+        if not self.max_entries or len(lats) > MAX_ROW:
+            return self.provider.to_point(lats, lons, lat, lon)
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        key = point_key(lat, lon)
+        pairs = [(k << _POINT_BITS) | key if k < key else (key << _POINT_BITS) | k
+                 for k in point_keys(lats, lons).tolist()]
+        return np.array(self._lookup(pairs, lambda idx: self.provider.to_point(lats[idx], lons[idx], lat, lon)))
+
+    def matrix(self, lats, lons):
+        # Drop-in for distance.haversine_matrix
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        n = lats.size
+        if not self.max_entries or n > MAX_ROW:
+            return self.provider.rect(lats, lons, lats, lons)
+        keys = point_keys(lats, lons).tolist()
+        rows, cols = np.triu_indices(n, k=1)
+        pairs = [(keys[i] << _POINT_BITS) | keys[j] if keys[i] < keys[j] else (keys[j] << _POINT_BITS) | keys[i]
+                 for i, j in zip(rows.tolist(), cols.tolist())]
+        values = self._lookup(
+            pairs, lambda idx: self.provider.pairs(lats[rows[idx]], lons[rows[idx]], lats[cols[idx]], lons[cols[idx]]))
+        out = np.zeros((n, n))
+        out[rows, cols] = values
+        out[cols, rows] = values
+        return out
+
+    def _lookup(self, pairs, compute):
+        # km for every pair; compute(positions) measures the pairs at those
+        # positions that neither tier has
+        with self.lock:
+            get = self.entries.get
+            touch = self.entries.move_to_end
+            values = [get(pair) for pair in pairs]
+            for pair, km in zip(pairs, values):
+                if km is not None:
+                    touch(pair)
+        missing = [i for i, km in enumerate(values) if km is None]
+        if not missing:
+            with self.lock:
+                self.hits += len(pairs)
+            metrics.inc('smartroute_distance_cache_hits_total', len(pairs), tier='memory')
+            return values
+
+        computed = missing
+        found = self._disk_get([pairs[i] for i in missing])
+        if found is not None:
+            for i, km in zip(missing, found):
+                values[i] = km
+            computed = [i for i, km in zip(missing, found) if km != km]
+        if computed:
+            for i, km in zip(computed, compute(computed).tolist()):
+                values[i] = km
+
+        hits = len(pairs) - len(missing)
+        disk_hits = len(missing) - len(computed)
+        with self.lock:
+            self.hits += hits
+            self.disk_hits += disk_hits
+            self.misses += len(computed)
+            self.unsaved += len(missing)
+            for i in missing:
+                self.entries[pairs[i]] = values[i]
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        metrics.inc('smartroute_distance_cache_hits_total', hits, tier='memory')
+        metrics.inc('smartroute_distance_cache_hits_total', disk_hits, tier='disk')
+        metrics.inc('smartroute_distance_cache_misses_total', len(computed))
+        return values
+
+    def _disk_get(self, pairs):
+        # km for each pair, NaN where the disk tier does not have it
+        disk = self.disk
+        if disk is None or not len(disk):
+            return None
+        a = np.array([pair >> _POINT_BITS for pair in pairs], dtype=np.int64)
+        b = np.array([pair & ((1 << _POINT_BITS) - 1) for pair in pairs], dtype=np.int64)
+        h = _pair_hash(a, b)
+        pos = np.minimum(np.searchsorted(disk['hash'], h), len(disk) - 1)
+        records = disk[pos]
+        match = (records['hash'] == h) & (records['a'] == a) & (records['b'] == b)
+        return np.where(match, records['km'], np.nan).tolist()
+
+    def save(self, min_unsaved=0):
+        # Merge the memory tier into the disk tier; memory entries replace
+        # disk records for the same pair. Returns whether anything was written
+        if not self.path or self.unsaved == 0 or self.unsaved < min_unsaved:
+            return False
+        with self.save_lock:
+            self._save()
+        return True
+
+    def _save(self):
+        with self.lock:
+            pairs = list(self.entries.keys())
+            km = np.fromiter(self.entries.values(), dtype=np.float64, count=len(pairs))
+            self.unsaved = 0
+        fresh = np.empty(len(pairs), dtype=DISK_DTYPE)
+        fresh['a'] = [pair >> _POINT_BITS for pair in pairs]
+        fresh['b'] = [pair & ((1 << _POINT_BITS) - 1) for pair in pairs]
+        fresh['hash'] = _pair_hash(fresh['a'], fresh['b'])
+        fresh['km'] = km
+        fresh = fresh[-self.max_disk_entries:]
+
+        directory = os.path.dirname(self.path) or '.'
+        with locked(self.path + '.lock'):
+            # Merge with the file as other processes have left it, not with
+            # this process's view of it
+            disk = np.load(self.path, mmap_mode='r') if os.path.exists(self.path) else None
+            if disk is not None and len(fresh) < self.max_disk_entries:
+                old = np.asarray(disk)
+                # Over max_disk_entries, old records are dropped in hash
+                # order, i.e. arbitrarily
+                seen = np.isin(old['hash'], fresh['hash'])
+                old = old[~seen][:self.max_disk_entries - len(fresh)]
+                records = np.concatenate([old, fresh])
+            else:
+                records = fresh
+            records = records[np.argsort(records['hash'], kind='stable')]
+
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self.path) + '.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.save(f, records)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            self.disk = np.load(self.path, mmap_mode='r')
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.unsaved = 0
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'disk_entries': len(self.disk) if self.disk is not None else 0,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+        }
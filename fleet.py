@@ -0,0 +1,178 @@
+# Store and fleet configuration of a plan.
+#
+# A FleetConfig holds the stores shipments leave from, the vehicle types
+# each store has for the day, and the trip model: a trip takes
+# minutes_per_km per km of its MST plus minutes_per_stop per shipment, and a
+# vehicle only leaves with at least min_load of its capacity. Configs are
+# validated once; fleet_config() caches them by content, so requests that
+# send the same settings share one instance.
+import json
+from functools import lru_cache
+
+DEFAULT_STORE = {'id': 'default', 'latitude': 19.075887, 'longitude': 72.877911}
+
+# count and max_radius (km) may be null for unlimited
+DEFAULT_VEHICLES = [
+    {'type': '3W', 'count': 50, 'capacity': 5, 'max_radius': 15},
+    {'type': '4W-EV', 'count': 25, 'capacity': 8, 'max_radius': 20},
+    {'type': '4W', 'count': None, 'capacity': 25, 'max_radius': None},
+]
+
+MINUTES_PER_KM = 5
+MINUTES_PER_STOP = 10
+MIN_LOAD = 0.5
+
+
+def _number(value, name, minimum=0, maximum=None, allow_none=False):
+    if value is None and allow_none:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value != value:
+        raise ValueError(f'{name} must be a number')
+    if value < minimum or (maximum is not None and value > maximum):
+        raise ValueError(f'{name} must be between {minimum} and {maximum}' if maximum is not None
+                         else f'{name} must be at least {minimum}')
+    return value
+
+
+def _check_keys(value, allowed, name):
+    if not isinstance(value, dict):
+        raise ValueError(f'{name} must be an object')
+    unknown = set(value) - set(allowed)
+    if unknown:
+        raise ValueError(f'Unknown {name} fields: {", ".join(sorted(unknown))}')
+
+
+def _vehicle(value, name):
+    _check_keys(value, ('type', 'count', 'capacity', 'max_radius'), name)
+    vtype = value.get('type')
+    if not isinstance(vtype, str) or not vtype:
+        raise ValueError(f'{name}.type must be a non-empty string')
+    count = _number(value.get('count'), f'{name}.count', allow_none=True)
+    capacity = _number(value.get('capacity'), f'{name}.capacity', minimum=1)
+    if (count is not None and count != int(count)) or capacity != int(capacity):
+        raise ValueError(f'{name}.count and capacity must be whole numbers')
+    max_radius = _number(value.get('max_radius'), f'{name}.max_radius', allow_none=True)
+    return {
+        'type': vtype,
+        'count': None if count is None else int(count),
+        'capacity': int(capacity),
+        'max_radius': None if max_radius is None else float(max_radius),
+    }
+
+
+def _vehicles(value, name):
+    if not isinstance(value, list) or not value:
+        raise ValueError(f'{name} must be a non-empty list')
+    vehicles = tuple(_vehicle(v, f'{name}[{i}]') for i, v in enumerate(value))
+    types = [v['type'] for v in vehicles]
+    if len(set(types)) != len(types):
+        raise ValueError(f'{name} has duplicate vehicle types')
+    return vehicles
+
+
+class Store:
+    __slots__ = ('id', 'lat', 'lon', 'vehicles')
+
+    def __init__(self, store_id, lat, lon, vehicles):
+        self.id = store_id
+        self.lat = lat
+        self.lon = lon
+        self.vehicles = vehicles
+
+    @property
+    def location(self):
+        return self.lat, self.lon
+
+    def budget(self):
+        # Fresh vehicle list for one plan; solving spends 'remaining'
+        return [{
+            'type': v['type'],
+            'remaining': float('inf') if v['count'] is None else v['count'],
+            'capacity': v['capacity'],
+            'max_radius': float('inf') if v['max_radius'] is None else v['max_radius'],
+        } for v in self.vehicles]
+
+    def __repr__(self):
+        return f'<Store {self.id}: {self.lat}, {self.lon}>'
+
+
+class FleetConfig:
+    __slots__ = ('stores', 'minutes_per_km', 'minutes_per_stop', 'min_load', 'by_id')
+
+    def __init__(self, stores, minutes_per_km=MINUTES_PER_KM, minutes_per_stop=MINUTES_PER_STOP,
+                 min_load=MIN_LOAD):
+        self.stores = stores
+        self.minutes_per_km = minutes_per_km
+        self.minutes_per_stop = minutes_per_stop
+        self.min_load = min_load
+        self.by_id = {store.id: store for store in stores}
+
+    def trip_time(self, mst_dist, stops):
+        return (mst_dist * self.minutes_per_km) + (stops * self.minutes_per_stop)
+
+    def with_store(self, store_id, lat, lon):
+        # This fleet's trip model and first store's vehicles at another store
+        return FleetConfig((Store(store_id, float(lat), float(lon), self.stores[0].vehicles),),
+                           self.minutes_per_km, self.minutes_per_stop, self.min_load)
+
+    def to_dict(self):
+        return {
+            'stores': [{'id': s.id, 'latitude': s.lat, 'longitude': s.lon, 'vehicles': [dict(v) for v in s.vehicles]}
+                       for s in self.stores],
+            'minutes_per_km': self.minutes_per_km,
+            'minutes_per_stop': self.minutes_per_stop,
+            'min_load': self.min_load,
+        }
+
+    def __repr__(self):
+        return f'<FleetConfig: {len(self.stores)} store(s)>'
+
+
+def _parse(value):
+    _check_keys(value, ('stores', 'vehicles', 'minutes_per_km', 'minutes_per_stop', 'min_load'), 'fleet')
+    vehicles = _vehicles(value.get('vehicles', DEFAULT_VEHICLES), 'fleet.vehicles')
+    stores_value = value.get('stores', [DEFAULT_STORE])
+    if not isinstance(stores_value, list) or not stores_value:
+        raise ValueError('fleet.stores must be a non-empty list')
+    stores = []
+    for i, store in enumerate(stores_value):
+        name = f'fleet.stores[{i}]'
+        _check_keys(store, ('id', 'latitude', 'longitude', 'vehicles'), name)
+        store_id = store.get('id', DEFAULT_STORE['id'] if len(stores_value) == 1 else None)
+        if not isinstance(store_id, str) or not store_id:
+            raise ValueError(f'{name}.id must be a non-empty string')
+        lat = _number(store.get('latitude'), f'{name}.latitude', minimum=-90, maximum=90)
+        lon = _number(store.get('longitude'), f'{name}.longitude', minimum=-180, maximum=180)
+        store_vehicles = _vehicles(store['vehicles'], f'{name}.vehicles') if 'vehicles' in store else vehicles
+        stores.append(Store(store_id, float(lat), float(lon), store_vehicles))
+    if len({store.id for store in stores}) != len(stores):
+        raise ValueError('fleet.stores has duplicate ids')
+    return (
+        tuple(stores),
+        _number(value.get('minutes_per_km', MINUTES_PER_KM), 'fleet.minutes_per_km'),
+        _number(value.get('minutes_per_stop', MINUTES_PER_STOP), 'fleet.minutes_per_stop'),
+        _number(value.get('min_load', MIN_LOAD), 'fleet.min_load', maximum=1),
+    )
+
+
+@lru_cache(maxsize=256)
+def _cached(key):
+    return FleetConfig(*_parse(json.loads(key)))
+
+
+def fleet_config(value=None):
+    # A request's "fleet" object -> FleetConfig; raises ValueError if invalid
+    if isinstance(value, FleetConfig):
+        return value
+    if value is None:
+        value = {}
+    try:
+        key = json.dumps(value, sort_keys=True, allow_nan=False)
+    except (TypeError, ValueError):
+        raise ValueError('fleet must be a JSON object') from None
+    return _cached(key)
+
+
+def load_fleet(path):
+    with open(path) as f:
+        return fleet_config(json.load(f))
@@ -0,0 +1,354 @@
+# Streaming ingestion of shipment uploads into column arrays.
+#
+# NDJSON and CSV bodies are parsed chunk by chunk as they arrive, and
+# spreadsheets are read row by row, so no intermediate list of per-shipment
+# dicts is ever built. Each distinct delivery timeslot string is parsed once.
+import csv
+import io
+import json
+import sys
+from array import array
+from functools import lru_cache
+
+import numpy as np
+
+# Accepted spellings of each column, after lower-casing and replacing
+# spaces with underscores ('Shipment ID' -> 'shipment_id')
+COLUMN_ALIASES = {
+    'shipment_id': 'shipment_id',
+    'id': 'shipment_id',
+    'latitude': 'latitude',
+    'latitute': 'latitude',
+    'lat': 'latitude',
+    'longitude': 'longitude',
+    'lon': 'longitude',
+    'delivery_timeslot': 'delivery_timeslot',
+    'timeslot': 'delivery_timeslot',
+}
+
+FORMATS = ('ndjson', 'csv')
+
+
+@lru_cache(maxsize=4096)
+def parse_clock(value):
+    # '09:30' (or '09:30:00') -> minutes
+    hours, minutes = value.strip().split(':')[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+def parse_timeslot(timeslot):
+    # '09:00-10:00' (or '09:30:00-12:00:00') -> (start, end) in minutes
+    start, end = timeslot.split('-')
+    return parse_clock(start), parse_clock(end)
+
+
+def _normalize_id(value):
+    # Spreadsheets hand back numeric ids as floats
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+class ShipmentColumns:
+    def __init__(self, ids, lat, lon, start, end):
+        self.ids = ids
+        self.lat = lat
+        self.lon = lon
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __repr__(self):
+        return f'<ShipmentColumns: {len(self)} shipments>'
+
+
+class ColumnBuilder:
+    def __init__(self):
+        self.ids = []
+        self.lat = array('d')
+        self.lon = array('d')
+        self.start = array('i')
+        self.end = array('i')
+
+    def append(self, shipment_id, latitude, longitude, timeslot):
+        start, end = parse_timeslot(sys.intern(str(timeslot)))
+        self.ids.append(_normalize_id(shipment_id))
+        self.lat.append(float(latitude))
+        self.lon.append(float(longitude))
+        self.start.append(start)
+        self.end.append(end)
+
+    def append_record(self, record):
+        self.append(record['shipment_id'], record['latitude'], record['longitude'], record['delivery_timeslot'])
+
+    def build(self):
+        return ShipmentColumns(
+            self.ids,
+            np.frombuffer(self.lat, dtype=np.float64),
+            np.frombuffer(self.lon, dtype=np.float64),
+            np.frombuffer(self.start, dtype=np.intc),
+            np.frombuffer(self.end, dtype=np.intc),
+        )
+
+
+def shipment_positions(table):
+    # {str(shipment id): row}, for addressing shipments by id
+    positions = {str(shipment_id): i for i, shipment_id in enumerate(table.ids)}
+    if len(positions) != len(table.ids):
+        raise ValueError('Shipment IDs are not unique')
+    return positions
+
+
+def edit_columns(table, add=(), remove=(), move=()):
+    # Applies changes by shipment id: remove ids, move entries
+    # ({'shipment_id', and any of latitude, longitude, delivery_timeslot})
+    # in place, and append add records. Returns the new table and the
+    # (start, end) slots whose shipments changed
+    positions = shipment_positions(table)
+    lat = table.lat.copy()
+    lon = table.lon.copy()
+    start = table.start.copy()
+    end = table.end.copy()
+    keep = np.ones(len(table), dtype=bool)
+    touched = set()
+
+    def find(shipment_id):
+        pos = positions.get(str(shipment_id))
+        if pos is None or not keep[pos]:
+            raise ValueError(f'Unknown shipment: {shipment_id!r}')
+        return pos
+
+    try:
+        for shipment_id in remove:
+            pos = find(shipment_id)
+            keep[pos] = False
+            touched.add((int(start[pos]), int(end[pos])))
+        for change in move:
+            pos = find(change['shipment_id'])
+            touched.add((int(start[pos]), int(end[pos])))
+            if 'latitude' in change:
+                lat[pos] = float(change['latitude'])
+            if 'longitude' in change:
+                lon[pos] = float(change['longitude'])
+            if 'delivery_timeslot' in change:
+                start[pos], end[pos] = parse_timeslot(sys.intern(str(change['delivery_timeslot'])))
+            touched.add((int(start[pos]), int(end[pos])))
+        builder = ColumnBuilder()
+        added = set()
+        for record in add:
+            key = str(record['shipment_id'])
+            if key in added or (key in positions and keep[positions[key]]):
+                raise ValueError(f'Duplicate shipment: {record["shipment_id"]!r}')
+            added.add(key)
+            builder.append_record(record)
+    except KeyError as e:
+        raise ValueError(f'Missing field: {e}') from None
+    new = builder.build()
+    touched.update(zip(new.start.tolist(), new.end.tolist()))
+
+    rows = np.flatnonzero(keep)
+    return ShipmentColumns(
+        [table.ids[i] for i in rows.tolist()] + new.ids,
+        np.concatenate([lat[rows], new.lat]),
+        np.concatenate([lon[rows], new.lon]),
+        np.concatenate([start[rows], new.start]),
+        np.concatenate([end[rows], new.end]),
+    ), touched
+
+
+def diff_columns(table, new, freeze_before=None):
+    # Brings table up to date with new, a later copy of the same shipments:
+    # ids only in table are removed, ids only in new are added and ids in
+    # both take new's coordinates and slot. Shipments in slots starting
+    # before freeze_before (minutes) stay as table has them, whatever new
+    # says about them; a shipment new adds to such a slot or moves into one
+    # would be dropped, so it is a ValueError. Returns the table, the slots
+    # that changed like edit_columns, and {'added', 'removed', 'moved'}
+    positions = shipment_positions(table)
+    shipment_positions(new)
+    old_row = np.fromiter((positions.get(str(shipment_id), -1) for shipment_id in new.ids), dtype=np.int64,
+                          count=len(new))
+    matched = old_row >= 0
+    if freeze_before is None:
+        frozen = np.zeros(len(table), dtype=bool)
+        take = np.ones(len(new), dtype=bool)
+    else:
+        frozen = table.start < freeze_before
+        was_frozen = matched & frozen[np.maximum(old_row, 0)]
+        late = np.flatnonzero((new.start < freeze_before) & ~was_frozen)
+        if late.size:
+            ids = ', '.join(repr(new.ids[i]) for i in late[:5].tolist())
+            more = f' and {late.size - 5} more' if late.size > 5 else ''
+            raise ValueError(f'Shipments added to or moved into frozen time slots: {ids}{more}')
+        take = (new.start >= freeze_before) & ~was_frozen
+
+    keep = frozen.copy()
+    updated = np.flatnonzero(take & matched)
+    rows = old_row[updated]
+    keep[rows] = True
+    lat = table.lat.copy()
+    lon = table.lon.copy()
+    start = table.start.copy()
+    end = table.end.copy()
+    moved = ((lat[rows] != new.lat[updated]) | (lon[rows] != new.lon[updated])
+             | (start[rows] != new.start[updated]) | (end[rows] != new.end[updated]))
+    touched = set(zip(start[~keep].tolist(), end[~keep].tolist()))
+    touched.update(zip(start[rows[moved]].tolist(), end[rows[moved]].tolist()))
+    touched.update(zip(new.start[updated[moved]].tolist(), new.end[updated[moved]].tolist()))
+    lat[rows], lon[rows], start[rows], end[rows] = (new.lat[updated], new.lon[updated], new.start[updated],
+                                                    new.end[updated])
+
+    added = np.flatnonzero(take & ~matched)
+    touched.update(zip(new.start[added].tolist(), new.end[added].tolist()))
+    kept = np.flatnonzero(keep)
+    return ShipmentColumns(
+        [table.ids[i] for i in kept.tolist()] + [new.ids[i] for i in added.tolist()],
+        np.concatenate([lat[kept], new.lat[added]]),
+        np.concatenate([lon[kept], new.lon[added]]),
+        np.concatenate([start[kept], new.start[added]]),
+        np.concatenate([end[kept], new.end[added]]),
+    ), touched, {'added': len(added), 'removed': int((~keep).sum()), 'moved': int(moved.sum())}
+
+
+def _column_map(header):
+    mapping = {}
+    for pos, name in enumerate(header):
+        key = COLUMN_ALIASES.get(str(name).strip().lower().replace(' ', '_'))
+        if key and key not in mapping:
+            mapping[key] = pos
+    missing = [key for key in ('shipment_id', 'latitude', 'longitude', 'delivery_timeslot') if key not in mapping]
+    if missing:
+        raise ValueError(f'Missing columns: {", ".join(missing)}')
+    return mapping
+
+
+class ShipmentParser:
+    # Incremental parser; feed() raw bytes in any chunking, then close()
+
+    def __init__(self, fmt='ndjson'):
+        if fmt not in FORMATS:
+            raise ValueError(f'Unknown upload format: {fmt!r}')
+        self.fmt = fmt
+        self.builder = ColumnBuilder()
+        self.columns = None
+        self.line_no = 0
+        self._tail = b''
+
+    def feed(self, chunk):
+        lines = (self._tail + chunk).split(b'\n')
+        self._tail = lines.pop()
+        self._parse_lines(lines)
+
+    def close(self):
+        if self._tail:
+            self._parse_lines([self._tail])
+            self._tail = b''
+        return self.builder.build()
+
+    def _parse_lines(self, lines):
+        if self.fmt == 'ndjson':
+            # Decode the whole chunk as one JSON array; only on failure go
+            # line by line to report where the bad record is
+            first_line = self.line_no + 1
+            self.line_no += len(lines)
+            records = [line for line in lines if line.strip()]
+            try:
+                for record in json.loads(b'[' + b','.join(records) + b']'):
+                    self.builder.append_record(record)
+            except (ValueError, KeyError, TypeError):
+                self._locate_error(lines, first_line)
+                raise
+        else:
+            rows = csv.reader(line.decode('utf-8-sig').rstrip('\r') for line in lines)
+            for row in rows:
+                self.line_no += 1
+                if not row:
+                    continue
+                if self.columns is None:
+                    self.columns = _column_map(row)
+                    continue
+                c = self.columns
+                try:
+                    self.builder.append(row[c['shipment_id']], row[c['latitude']], row[c['longitude']],
+                                        row[c['delivery_timeslot']])
+                except (ValueError, IndexError) as e:
+                    raise ValueError(f'Line {self.line_no}: {e}') from None
+
+    def _locate_error(self, lines, first_line):
+        for line_no, line in enumerate(lines, first_line):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                ColumnBuilder().append_record(record)
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError(f'Line {line_no}: {e}') from None
+
+
+def read_stream(stream, fmt='ndjson', chunk_size=1 << 20):
+    # Parse a binary file object without loading it whole
+    parser = ShipmentParser(fmt)
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        parser.feed(chunk)
+    return parser.close()
+
+
+def read_records(records):
+    # Payload dicts as posted to /optimize
+    builder = ColumnBuilder()
+    for record in records:
+        builder.append_record(record)
+    return builder.build()
+
+
+def read_excel(path, sheet_name='Shipments_Data'):
+    # Row-by-row spreadsheet reader (openpyxl read-only mode)
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook[sheet_name].iter_rows(values_only=True)
+        c = _column_map(next(rows))
+        builder = ColumnBuilder()
+        for row in rows:
+            if row[c['shipment_id']] is None:
+                continue
+            builder.append(row[c['shipment_id']], row[c['latitude']], row[c['longitude']],
+                           row[c['delivery_timeslot']])
+        return builder.build()
+    finally:
+        workbook.close()
+
+
+def read_store_location(path, sheet_name='Store Location'):
+    # (lat, lon) from a workbook's store sheet, or None if it has none
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        if sheet_name not in workbook.sheetnames:
+            return None
+        rows = workbook[sheet_name].iter_rows(values_only=True)
+        header = [COLUMN_ALIASES.get(str(name).strip().lower().replace(' ', '_')) for name in next(rows)]
+        missing = [key for key in ('latitude', 'longitude') if key not in header]
+        if missing:
+            raise ValueError(f'{sheet_name}: missing columns: {", ".join(missing)}')
+        lat_pos, lon_pos = header.index('latitude'), header.index('longitude')
+        for row in rows:
+            if row[lat_pos] is not None:
+                return float(row[lat_pos]), float(row[lon_pos])
+        return None
+    finally:
+        workbook.close()
+
+
+def read_file(path, sheet_name='Shipments_Data'):
+    # Dispatch on extension: .xlsx, .csv, or .ndjson/.jsonl
+    lower = path.lower()
+    if lower.endswith(('.xlsx', '.xlsm')):
+        return read_excel(path, sheet_name)
+    fmt = 'csv' if lower.endswith('.csv') else 'ndjson'
+    with io.open(path, 'rb') as stream:
+        return read_stream(stream, fmt)
@@ -0,0 +1,184 @@
+# Process-wide metrics, phase timers and an opt-in sampling profiler.
+#
+# Metrics are kept in plain dicts behind one lock and rendered in the
+# Prometheus text exposition format by /metrics. Worker processes (parallel
+# slot solving) take a snapshot before and after their work and send the
+# difference back so the parent can merge it.
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Upper bounds, in seconds, of the duration histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+DESCRIPTIONS = {
+    'smartroute_phase_seconds': ('histogram', 'Time spent per optimizer phase'),
+    'smartroute_slot_seconds': ('histogram', 'Time spent solving one time slot'),
+    'smartroute_slot_pool_broken_total': ('counter', 'Parallel solves finished in-process after a slot worker died'),
+    'smartroute_optimize_seconds': ('histogram', 'End-to-end optimize_routes duration'),
+    'smartroute_optimize_total': ('counter', 'optimize_routes calls'),
+    'smartroute_shipments_total': ('counter', 'Shipments submitted for optimization'),
+    'smartroute_trips_total': ('counter', 'Trips produced'),
+    'smartroute_replan_total': ('counter', 'Incremental plan changes applied'),
+    'smartroute_warm_starts_total': ('counter', 'Plans warm-started from a previous plan'),
+    'smartroute_mst_updates_total': ('counter', 'Incremental MST point insertions'),
+    'smartroute_feasibility_checks_total': ('counter', 'Vehicle feasibility checks while batching'),
+    'smartroute_compute_mst_total': ('counter', 'Full compute_mst evaluations'),
+    'smartroute_tsp_total': ('counter', 'Nearest-neighbour tour constructions'),
+    'smartroute_haversine_calls_total': ('counter', 'Vectorized haversine kernel calls'),
+    'smartroute_haversine_pairs_total': ('counter', 'Point pairs measured by the haversine kernels'),
+    'smartroute_distance_cache_hits_total': ('counter', 'Point pair distances served by the distance cache'),
+    'smartroute_distance_cache_misses_total': ('counter', 'Point pair distances the distance cache had to compute'),
+    'smartroute_road_pairs_total': ('counter', 'Point pair distances measured on the road graph'),
+    'smartroute_road_tables_total': ('counter', 'Slot distance tables written for the road graph'),
+}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    hist[0][i] += 1
+                    break
+            hist[1] += seconds
+            hist[2] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return (dict(self.counters),
+                    {key: [list(h[0]), h[1], h[2]] for key, h in self.histograms.items()})
+
+    def delta(self, before):
+        # Everything recorded since snapshot() returned `before`
+        counters, histograms = self.snapshot()
+        old_counters, old_histograms = before
+        counters = {k: v - old_counters.get(k, 0) for k, v in counters.items() if v != old_counters.get(k, 0)}
+        for key, (buckets, total, count) in list(histograms.items()):
+            old = old_histograms.get(key)
+            if old:
+                histograms[key] = [[a - b for a, b in zip(buckets, old[0])], total - old[1], count - old[2]]
+        return counters, {k: h for k, h in histograms.items() if h[2]}
+
+    def merge(self, delta):
+        counters, histograms = delta
+        with self.lock:
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, (buckets, total, count) in histograms.items():
+                hist = self.histograms.get(key)
+                if hist is None:
+                    hist = self.histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+                hist[0] = [a + b for a, b in zip(hist[0], buckets)]
+                hist[1] += total
+                hist[2] += count
+
+    def render(self, gauges=None):
+        # Prometheus text format; gauges is {name: (help, value)} sampled now
+        counters, histograms = self.snapshot()
+        by_name = {}
+        for (name, labels), value in counters.items():
+            by_name.setdefault(name, []).append(('counter', labels, value))
+        for (name, labels), hist in histograms.items():
+            by_name.setdefault(name, []).append(('histogram', labels, hist))
+
+        lines = []
+        for name in sorted(by_name):
+            kind, description = DESCRIPTIONS.get(name, (by_name[name][0][0], name))
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for kind, labels, value in sorted(by_name[name], key=lambda item: item[1]):
+                if kind == 'counter':
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+                    continue
+                buckets, total, count = value
+                cumulative = 0
+                for bound, n in zip(BUCKETS, buckets):
+                    cumulative += n
+                    lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {count}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+                lines.append(f'{name}_count{_format_labels(labels)} {count}')
+        for name, (description, value) in sorted((gauges or {}).items()):
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe('smartroute_phase_seconds', time.perf_counter() - start, phase=name)
+
+
+class SamplingProfiler:
+    # Samples one thread's Python stack every `interval` seconds from a
+    # background thread. Output is in collapsed-stack format ("a;b;c count"),
+    # which flamegraph.pl and speedscope read directly.
+
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='smartroute-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        return self.collapsed()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
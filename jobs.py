@@ -0,0 +1,102 @@
+# Background job queue for optimization requests.
+#
+# Jobs run in a bounded thread pool so the event loop never executes a solve
+# itself. The heavy lifting can be pushed further out to worker processes
+# with optimize_routes(parallel=True), in which case the job thread mostly
+# waits on the slot pool.
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import SamplingProfiler
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class Job:
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = 'queued'
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.future = None
+        self.profile = None
+
+    def set_progress(self, done, total):
+        self.progress = done / total if total else 1.0
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'progress': round(self.progress, 4),
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class JobQueue:
+    def __init__(self, max_workers=2, max_pending=16, history=100):
+        self.max_pending = max_pending
+        self.history = history
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='smartroute-job')
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def pending(self):
+        with self.lock:
+            return self._pending()
+
+    def _pending(self):
+        # Callers hold self.lock, which submit and _evict change jobs under
+        return sum(1 for job in self.jobs.values() if job.status in ('queued', 'running'))
+
+    def submit(self, fn, *args, profile=False, **kwargs):
+        # fn is called with a progress(done, total) keyword argument. With
+        # profile=True the job thread is sampled and the collapsed stacks are
+        # kept on job.profile
+        with self.lock:
+            if self._pending() >= self.max_pending:
+                raise QueueFullError(f'Job queue is full ({self.max_pending} jobs pending)')
+            job = Job()
+            self.jobs[job.id] = job
+            self._evict()
+            job.future = self.executor.submit(self._run, job, fn, args, kwargs, profile)
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def _evict(self):
+        # Drop the oldest finished jobs beyond the history limit
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in ('done', 'failed')]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[job_id]
+
+    def _run(self, job, fn, args, kwargs, profile=False):
+        job.status = 'running'
+        job.started = time.time()
+        profiler = SamplingProfiler(threading.get_ident()).start() if profile else None
+        try:
+            job.result = fn(*args, progress=job.set_progress, **kwargs)
+            job.progress = 1.0
+            job.status = 'done'
+            return job.result
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+            raise
+        finally:
+            if profiler:
+                job.profile = profiler.stop()
+            job.finished = time.time()
@@ -0,0 +1,206 @@
+# Post-optimization local search on trip tours.
+#
+# A tour is a list of node ids into a distance matrix, starting at the store
+# and returning to it after the last stop. improve_tour applies 2-opt and
+# Or-opt (segments of up to three stops, either orientation) moves to one
+# tour; improve_slot relocates and exchanges stops between the tours of one
+# time slot. Both only try moves that create an edge to one of a stop's
+# nearest neighbours, price them by the edges they change, take any
+# improving move, and stop at a local optimum or at the deadline.
+import time
+
+import numpy as np
+
+NEIGHBORS = 8
+OR_OPT_SEGMENT = 3
+EPSILON = 1e-9
+
+
+def tour_length(dist, tour):
+    return sum(float(dist[a][b]) for a, b in zip(tour, tour[1:] + tour[:1])) if len(tour) > 1 else 0.0
+
+
+def neighbor_lists(dist, k=NEIGHBORS, nodes=None):
+    # The k nearest other nodes of every node, nearest first; restricted to
+    # `nodes` (ids into dist) when given
+    dist = np.asarray(dist)
+    nodes = np.arange(len(dist)) if nodes is None else np.asarray(nodes)
+    k = min(k, len(nodes) - 1)
+    if k <= 0:
+        return {int(v): [] for v in nodes}
+    sub = dist[np.ix_(nodes, nodes)]
+    np.fill_diagonal(sub, np.inf)
+    nearest = np.argpartition(sub, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(sub, nearest, axis=1).argsort(axis=1, kind='stable')
+    nearest = nodes[np.take_along_axis(nearest, order, axis=1)]
+    return dict(zip(nodes.tolist(), nearest.tolist()))
+
+
+def _reverse(t, pos, start, end):
+    # Reverse t from position start forward (cyclically) to position end
+    n = len(t)
+    for k in range(((end - start) % n + 1) // 2):
+        x = (start + k) % n
+        y = (end - k) % n
+        t[x], t[y] = t[y], t[x]
+        pos[t[x]] = x
+        pos[t[y]] = y
+
+
+def _two_opt(t, d, nbrs, deadline):
+    n = len(t)
+    pos = {v: i for i, v in enumerate(t)}
+    improved = False
+    restart = True
+    while restart and time.perf_counter() < deadline:
+        restart = False
+        for a in list(t):
+            i = pos[a]
+            succ = t[(i + 1) % n]
+            pred = t[i - 1]
+            for c in nbrs[a]:
+                dac = d[a][c]
+                if dac >= d[a][succ] and dac >= d[pred][a]:
+                    break
+                j = pos[c]
+                # Edges (a, succ) and (c, c_succ) become (a, c) and (succ, c_succ)
+                c_succ = t[(j + 1) % n]
+                if c != succ and c_succ != a and dac + d[succ][c_succ] - d[a][succ] - d[c][c_succ] < -EPSILON:
+                    _reverse(t, pos, (i + 1) % n, j)
+                    restart = True
+                    break
+                # Edges (pred, a) and (c_pred, c) become (a, c) and (pred, c_pred)
+                c_pred = t[j - 1]
+                if c != pred and c_pred != a and dac + d[pred][c_pred] - d[pred][a] - d[c_pred][c] < -EPSILON:
+                    _reverse(t, pos, i, (j - 1) % n)
+                    restart = True
+                    break
+            if restart:
+                improved = True
+                break
+    return improved
+
+
+def _or_opt(t, d, nbrs, deadline):
+    n = len(t)
+    improved = False
+    restart = True
+    while restart and time.perf_counter() < deadline:
+        restart = False
+        for length in range(1, min(OR_OPT_SEGMENT, n - 3) + 1):
+            for i in range(n):
+                seg = [t[(i + k) % n] for k in range(length)]
+                prev, nxt = t[i - 1], t[(i + length) % n]
+                first, last = seg[0], seg[-1]
+                gain = d[prev][first] + d[last][nxt] - d[prev][nxt]
+                rest = [t[(i + length + k) % n] for k in range(n - length)]
+                rest_pos = {v: k for k, v in enumerate(rest)}
+                best = None
+                for end in ((first,) if length == 1 else (first, last)):
+                    other = last if end == first else first
+                    for c in nbrs[end]:
+                        if d[c][end] >= gain:
+                            break
+                        k = rest_pos.get(c)
+                        if k is None:
+                            continue
+                        # Insert between c and its successor entering at
+                        # `end`, or between c's predecessor and c leaving at it
+                        for p, q, head, tail in ((c, rest[(k + 1) % len(rest)], end, other),
+                                                 (rest[k - 1], c, other, end)):
+                            cost = d[p][head] + d[tail][q] - d[p][q]
+                            if cost - gain < -EPSILON and (best is None or cost < best[0]):
+                                best = (cost, p, head == first)
+                if best is not None:
+                    _, p, forward = best
+                    moved = seg if forward else seg[::-1]
+                    k = rest_pos[p] + 1
+                    t[:] = rest[:k] + moved + rest[k:]
+                    restart = True
+                    break
+            if restart:
+                improved = True
+                break
+    return improved
+
+
+def improve_tour(dist, tour, deadline, neighbors=NEIGHBORS):
+    # Returns (tour, km) with tour[0] still the store
+    if len(tour) < 4 or time.perf_counter() >= deadline:
+        return list(tour), tour_length(dist, tour)
+    sub = np.asarray(dist)[np.ix_(tour, tour)]
+    d = sub.tolist()
+    nbrs = neighbor_lists(sub, neighbors)
+    t = list(range(len(tour)))
+    while time.perf_counter() < deadline:
+        if not (_two_opt(t, d, nbrs, deadline) | _or_opt(t, d, nbrs, deadline)):
+            break
+    k = t.index(0)
+    t = t[k:] + t[:k]
+    return [tour[i] for i in t], tour_length(d, t)
+
+
+def improve_slot(dist, tours, feasible, deadline, neighbors=NEIGHBORS):
+    # Relocate and exchange stops between the tours of one slot. Node 0 of
+    # dist is the store and every tour starts with it. feasible(k, stops)
+    # returns a state for tour k holding stops (e.g. its new MST
+    # length) or None if its vehicle cannot serve them. Tours are changed in
+    # place; returns {k: state} for every tour that changed
+    d = dist.tolist() if isinstance(dist, np.ndarray) else dist
+    owner = {v: k for k, tour in enumerate(tours) for v in tour[1:]}
+    nbrs = neighbor_lists(dist, neighbors, nodes=sorted(owner))
+    states = {}
+
+    def apply(a, stops_a, b, stops_b):
+        state_a = feasible(a, stops_a)
+        if state_a is None:
+            return False
+        state_b = feasible(b, stops_b)
+        if state_b is None:
+            return False
+        tours[a][1:] = stops_a
+        tours[b][1:] = stops_b
+        states[a] = state_a
+        states[b] = state_b
+        for v in stops_a:
+            owner[v] = a
+        for v in stops_b:
+            owner[v] = b
+        return True
+
+    restart = True
+    while restart and time.perf_counter() < deadline:
+        restart = False
+        for u in sorted(owner):
+            a = owner[u]
+            ta = tours[a]
+            i = ta.index(u)
+            up, un = ta[i - 1], ta[(i + 1) % len(ta)]
+            removal = d[up][u] + d[u][un] - d[up][un]
+            for v in nbrs[u]:
+                b = owner[v]
+                if b == a:
+                    continue
+                tb = tours[b]
+                j = tb.index(v)
+                vp, vn = tb[j - 1], tb[(j + 1) % len(tb)]
+
+                # Relocate u next to v
+                after = d[v][u] + d[u][vn] - d[v][vn]
+                before = d[vp][u] + d[u][v] - d[vp][v]
+                if min(after, before) - removal < -EPSILON:
+                    k = j + 1 if after <= before else j
+                    stops_b = tb[1:k] + [u] + tb[k:]
+                    if apply(a, ta[1:i] + ta[i + 1:], b, stops_b):
+                        restart = True
+                        break
+
+                # Exchange u and v
+                delta = (d[up][v] + d[v][un] - d[up][u] - d[u][un]) + (d[vp][u] + d[u][vn] - d[vp][v] - d[v][vn])
+                if delta < -EPSILON:
+                    if apply(a, ta[1:i] + [v] + ta[i + 1:], b, tb[1:j] + [u] + tb[j + 1:]):
+                        restart = True
+                        break
+            if restart or time.perf_counter() >= deadline:
+                break
+    return states
@@ -0,0 +1,51 @@
+# LRU cache of rendered map HTML.
+#
+# Keys include the plan version, so a re-optimized plan never serves stale
+# maps; entries for old versions simply age out. The cache is bounded both
+# by entry count and by total HTML size.
+import threading
+from collections import OrderedDict
+
+
+class MapCache:
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_or_render(self, key, render):
+        with self.lock:
+            html = self.entries.get(key)
+            if html is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return html
+            self.misses += 1
+        # Render outside the lock; two concurrent misses just render twice
+        html = render()
+        self.put(key, html)
+        return html
+
+    def put(self, key, html):
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            if len(html) > self.max_bytes:
+                return
+            self.entries[key] = html
+            self.size += len(html)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
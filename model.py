@@ -0,0 +1,121 @@
+# Compact plan model.
+#
+# Shipments live in one ShipmentColumns table (struct of arrays) and are
+# referred to by integer row index. A Trip holds indices into that table
+# rather than copies of shipment records. Rows in the API's JSON/CSV format
+# are only built by RoutePlan.to_rows().
+import numpy as np
+
+from fleet import MINUTES_PER_KM, MINUTES_PER_STOP
+
+
+class Trip:
+    # tour_dist is the length of the store -> stops -> store tour in
+    # shipment order, once the stops have been ordered. store and fleet are
+    # the fleet.Store the trip leaves from and the FleetConfig it was
+    # planned with
+    __slots__ = ('shipments', 'start', 'end', 'mst_dist', 'vehicle', 'vehicle_capacity', 'vehicle_max_radius',
+                 'tour_dist', 'store', 'fleet')
+
+    def __init__(self, shipments, start, end, mst_dist, vehicle, vehicle_capacity, vehicle_max_radius,
+                 tour_dist=None, store=None, fleet=None):
+        self.shipments = shipments
+        self.start = start
+        self.end = end
+        self.mst_dist = mst_dist
+        self.vehicle = vehicle
+        self.vehicle_capacity = vehicle_capacity
+        self.vehicle_max_radius = vehicle_max_radius
+        self.tour_dist = tour_dist
+        self.store = store
+        self.fleet = fleet
+
+    def __len__(self):
+        return len(self.shipments)
+
+    @property
+    def trip_time(self):
+        if self.fleet is not None:
+            return self.fleet.trip_time(self.mst_dist, len(self.shipments))
+        return (self.mst_dist * MINUTES_PER_KM) + (len(self.shipments) * MINUTES_PER_STOP)
+
+    @property
+    def time_uti(self):
+        available_time = self.end - self.start
+        return self.trip_time / available_time if available_time != 0 else 0
+
+    @property
+    def capacity_uti(self):
+        return len(self.shipments) / self.vehicle_capacity
+
+    @property
+    def cov_uti(self):
+        if self.vehicle_max_radius == float('inf'):
+            return 'N/A'
+        return self.mst_dist / self.vehicle_max_radius
+
+
+def trip_id(idx):
+    # Trips are numbered in plan order
+    return f'T{(idx+1):03}_1'
+
+
+def slot_label(start, end):
+    return f"{int(start/60):02d}:00-{int(end/60):02d}:00"
+
+
+def timeslot_groups(table):
+    # {(start, end): row indices}, slots ordered by start time and shipments
+    # kept in upload order within a slot
+    order = np.argsort(table.start, kind='stable')
+    groups = {}
+    for i, start, end in zip(order.tolist(), table.start[order].tolist(), table.end[order].tolist()):
+        groups.setdefault((start, end), []).append(i)
+    return {key: np.asarray(indices, dtype=np.int64) for key, indices in groups.items()}
+
+
+class RoutePlan:
+    # Rows name each trip's store in STORE_ID when the fleet has several
+    __slots__ = ('shipments', 'trips', 'fleet')
+
+    def __init__(self, shipments, trips, fleet=None):
+        self.shipments = shipments
+        self.trips = trips
+        self.fleet = fleet
+
+    def to_rows(self):
+        table = self.shipments
+        ids = table.ids
+        lat = table.lat.tolist()
+        lon = table.lon.tolist()
+        start = table.start.tolist()
+        end = table.end.tolist()
+
+        multi_store = self.fleet is not None and len(self.fleet.stores) > 1
+        output_data = []
+        for idx, trip in enumerate(self.trips):
+            trip_time = trip.trip_time
+            cov_uti = trip.cov_uti
+            trip_fields = {
+                'Shipments': len(trip.shipments),
+                'MST_DIST': round(trip.mst_dist, 2),
+                'TOUR_DIST': round(trip.tour_dist, 2) if trip.tour_dist is not None else None,
+                'TRIP_TIME': round(trip_time, 2),
+                'Vehicle_Type': trip.vehicle,
+                'CAPACITY_UTI': round(trip.capacity_uti, 2),
+                'TIME_UTI': round(trip.time_uti, 2),
+                'COV_UTI': round(cov_uti, 2) if isinstance(cov_uti, (int, float)) else cov_uti,
+            }
+            if multi_store:
+                trip_fields['STORE_ID'] = trip.store.id
+            trip_name = trip_id(idx)
+            for i in trip.shipments:
+                output_data.append({
+                    'TRIP_ID': trip_name,
+                    'Shipment_ID': ids[i],
+                    'Latitude': lat[i],
+                    'Longitude': lon[i],
+                    'TIME_SLOT': slot_label(start[i], end[i]),
+                    **trip_fields,
+                })
+        return output_data
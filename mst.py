@@ -0,0 +1,107 @@
+# Incremental minimum spanning tree over a growing batch of points.
+#
+# Vertex 0 is the root (the store). Adding a point rebuilds the tree in O(k)
+# with the Chin-Houck insertion: walk the existing tree once, and at every
+# tree edge keep the cheaper of that edge and the best edge carried up from
+# the subtree towards the new point.
+import numpy as np
+
+from distance import haversine_to_point
+
+
+class IncrementalMST:
+    def __init__(self, root, distances=haversine_to_point):
+        # distances(lats, lons, lat, lon) -> array of km from every vertex
+        self.distances = distances
+        self.lats = np.empty(32)
+        self.lons = np.empty(32)
+        self.lats[0], self.lons[0] = root
+        self.size = 1
+        self.adj = [[]]
+        self.weights = []
+        self._total = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, lat, lon):
+        z = self.size
+        # Distances from the new point to every vertex already in the tree
+        dz = self.distances(self.lats[:z], self.lons[:z], lat, lon).tolist()
+
+        new_adj = [[] for _ in range(z + 1)]
+        new_weights = []
+
+        def link(edge):
+            w, a, b = edge
+            new_adj[a].append((b, w))
+            new_adj[b].append((a, w))
+            new_weights.append(w)
+
+        # Iterative post-order walk; best[v] is the cheapest edge that can
+        # connect the subtree rooted at v to the new point
+        best = [None] * z
+        parent = [-1] * z
+        order = []
+        stack = [0]
+        while stack:
+            v = stack.pop()
+            order.append(v)
+            for w, _ in self.adj[v]:
+                if w != parent[v]:
+                    parent[w] = v
+                    stack.append(w)
+
+        for v in reversed(order):
+            m = (dz[v], v, z)
+            for w, weight in self.adj[v]:
+                if w == parent[v]:
+                    continue
+                t = best[w]
+                tree_edge = (weight, v, w)
+                if t[0] <= tree_edge[0]:
+                    keep, drop = t, tree_edge
+                else:
+                    keep, drop = tree_edge, t
+                link(keep)
+                if drop[0] < m[0]:
+                    m = drop
+            best[v] = m
+        link(best[0])
+
+        if z == self.lats.size:
+            self.lats = np.resize(self.lats, 2 * z)
+            self.lons = np.resize(self.lons, 2 * z)
+        self.lats[z] = lat
+        self.lons[z] = lon
+        self.size = z + 1
+        self.adj = new_adj
+        self.weights = new_weights
+        self._total = None
+        return self.total
+
+    @property
+    def total(self):
+        # Summed in ascending order so the result matches compute_mst exactly
+        if self._total is None:
+            self._total = sum(sorted(self.weights))
+        return self._total
+
+    def reset(self, root=None):
+        if root is not None:
+            self.lats[0], self.lons[0] = root
+        self.size = 1
+        self.adj = [[]]
+        self.weights = []
+        self._total = 0
+
+    def fork(self):
+        other = IncrementalMST.__new__(IncrementalMST)
+        other.distances = self.distances
+        other.lats = self.lats.copy()
+        other.lons = self.lons.copy()
+        other.size = self.size
+        other.adj = [list(edges) for edges in self.adj]
+        other.weights = list(self.weights)
+        other._total = self._total
+        return other
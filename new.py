@@ -1,12 +1,29 @@
-import math
+import numpy as np
 import pandas as pd
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import folium
 import json
 import uvicorn
 import os
+import asyncio
+import logging
+import threading
+from jobs import JobQueue, QueueFullError
+from trip_store import DEFAULT_PLAN, PlanConflictError, TripStore, is_valid_plan_name
+from map_cache import MapCache
+from ingest import (ShipmentColumns, ShipmentParser, diff_columns, edit_columns, parse_clock, read_records,
+                    shipment_positions)
+from model import RoutePlan, slot_label, trip_id
+from instrumentation import metrics, phase
+from planner import (DEFAULT_FLEET, DISTANCE_CACHE_SAVE_EVERY, SLOT_ORDERING, distance_cache, improve_trips,
+                     local_search_options, optimize_plan, plan_groups, prepare_distances, request_fleet,
+                     solve_timeslot)
+from responses import is_legacy, plan_body, response_options
+
+logger = logging.getLogger('smartroute')
 
 app = FastAPI()
 
@@ -19,202 +36,264 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Fixed store location
-STORE_LAT = 19.075887
-STORE_LON = 72.877911
-
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371  # Earth radius in km
-    dLat = math.radians(lat2 - lat1)
-    dLon = math.radians(lon2 - lon1)
-    a = math.sin(dLat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dLon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
-
-def compute_mst(points):
-    n = len(points)
-    edges = []
-    for i in range(n):
-        for j in range(i + 1, n):
-            dist = haversine(points[i][0], points[i][1], points[j][0], points[j][1])
-            edges.append((dist, i, j))
-    edges.sort()
-    parent = list(range(n))
-    def find(u):
-        while parent[u] != u:
-            parent[u] = parent[parent[u]]
-            u = parent[u]
-        return u
-    def union(u, v):
-        u_root = find(u)
-        v_root = find(v)
-        if u_root != v_root:
-            parent[v_root] = u_root
-    mst_sum = 0
-    mst_edges = []
-    for edge in edges:
-        dist, u, v = edge
-        if find(u) != find(v):
-            union(u, v)
-            mst_sum += dist
-            mst_edges.append(edge)
-            if len(mst_edges) == n - 1:
-                break
-    return mst_sum
-
-def convert_time_to_minutes(time_str):
-    return int(time_str.split(':')[0]) * 60 + int(time_str.split(':')[1])
-
-def tsp_nearest_neighbor(points):
-    n = len(points)
-    visited = [False] * n
-    path = [0]
-    visited[0] = True
-    current = 0
-    for _ in range(n - 1):
-        nearest_dist = float('inf')
-        nearest_idx = -1
-        for i in range(n):
-            if not visited[i]:
-                dist = haversine(points[current][0], points[current][1], points[i][0], points[i][1])
-                if dist < nearest_dist:
-                    nearest_dist = dist
-                    nearest_idx = i
-        if nearest_idx == -1:
-            break
-        path.append(nearest_idx)
-        visited[nearest_idx] = True
-        current = nearest_idx
-    path.append(0)
-    return path
-
-def check_capacity_constraints(num_shipments, vehicle_capacity):
-    min_shipments = math.ceil(vehicle_capacity * 0.5)
-    max_shipments = vehicle_capacity
-    return min_shipments <= num_shipments <= max_shipments
-
-def optimize_routes(shipments_data):
-    shipments = []
-    print("-------------------------------------")
-    print(type(shipments_data))
-    print(shipments_data)
-
-    for shipment in shipments_data:
-        start, end = shipment['delivery_timeslot'].split('-')
-        shipments.append({
-            'id': shipment['shipment_id'],
-            'lat': shipment['latitude'],
-            'lon': shipment['longitude'],
-            'start': convert_time_to_minutes(start.strip()),
-            'end': convert_time_to_minutes(end.strip())
-        })
+# The default store, where maps of plans without a stored fleet are centred
+STORE_LAT, STORE_LON = DEFAULT_FLEET.stores[0].location
 
-    vehicles = [
-        {'type': '3W', 'remaining': 50, 'capacity': 5, 'max_radius': 15},
-        {'type': '4W-EV', 'remaining': 25, 'capacity': 8, 'max_radius': 20},
-        {'type': '4W', 'remaining': float('inf'), 'capacity': 25, 'max_radius': float('inf')}
-    ]
+# Optimization jobs solved concurrently, and the most that may be queued or
+# running before new submissions are rejected
+JOB_WORKERS = int(os.environ.get('SMARTROUTE_JOB_WORKERS', 2))
+JOB_QUEUE_DEPTH = int(os.environ.get('SMARTROUTE_JOB_QUEUE_DEPTH', 16))
+job_queue = JobQueue(max_workers=JOB_WORKERS, max_pending=JOB_QUEUE_DEPTH)
 
-    shipments.sort(key=lambda x: x['start'])
-    timeslot_groups = {}
-    for shipment in shipments:
-        key = (shipment['start'], shipment['end'])
-        if key not in timeslot_groups:
-            timeslot_groups[key] = []
-        timeslot_groups[key].append(shipment)
+# Latest plans, served from memory and persisted in the background
+trip_store = TripStore(os.environ.get('SMARTROUTE_PLAN_DIR', 'plans'))
+# Serializes read-modify-write of stored plans by replan_shipments, and
+# full optimizations storing over them
+replan_lock = threading.Lock()
 
-    trips = []
+# Rendered map HTML keyed by (plan, plan version, trip id, mode). 'geojson'
+# draws each map as one compact FeatureCollection layer instead of a Marker
+# per shipment
+MAP_MODES = ('markers', 'geojson')
+map_cache = MapCache(
+    max_entries=int(os.environ.get('SMARTROUTE_MAP_CACHE_ENTRIES', 256)),
+    max_bytes=int(os.environ.get('SMARTROUTE_MAP_CACHE_MB', 64)) * 1024 * 1024,
+)
+# folium marker colours that are not valid CSS colours
+CSS_COLORS = {'lightred': 'lightcoral'}
 
-    for (start_time, end_time), group_shipments in timeslot_groups.items():
-        current_batch = []
-        
-        for shipment in group_shipments:
-            current_batch.append(shipment)
-            
-            for vehicle in vehicles:
-                if vehicle['remaining'] <= 0:
-                    continue
-                    
-                if check_capacity_constraints(len(current_batch), vehicle['capacity']):
-                    points = [(STORE_LAT, STORE_LON)] + [(s['lat'], s['lon']) for s in current_batch]
-                    mst_dist = compute_mst(points)
-                    
-                    if mst_dist <= vehicle['max_radius'] or vehicle['type'] == '4W':
-                        trip_time = (mst_dist * 5) + (len(current_batch) * 10)
-                        available_time = end_time - start_time
-                        
-                        if trip_time <= available_time:
-                            trips.append({
-                                'shipments': current_batch.copy(),
-                                'start': start_time,
-                                'end': end_time,
-                                'mst_dist': mst_dist,
-                                'vehicle': vehicle['type'],
-                                'vehicle_capacity': vehicle['capacity'],
-                                'vehicle_max_radius': vehicle['max_radius']
-                            })
-                            vehicle['remaining'] -= 1
-                            current_batch = []
-                            break
-        
-        if current_batch:
-            for vehicle in vehicles:
-                if vehicle['remaining'] <= 0:
-                    continue
-                
-                if len(current_batch) <= vehicle['capacity']:
-                    points = [(STORE_LAT, STORE_LON)] + [(s['lat'], s['lon']) for s in current_batch]
-                    mst_dist = compute_mst(points)
-                    
-                    if mst_dist <= vehicle['max_radius'] or vehicle['type'] == '4W':
-                        trips.append({
-                            'shipments': current_batch.copy(),
-                            'start': start_time,
-                            'end': end_time,
-                            'mst_dist': mst_dist,
-                            'vehicle': vehicle['type'],
-                            'vehicle_capacity': vehicle['capacity'],
-                            'vehicle_max_radius': vehicle['max_radius']
-                        })
-                        vehicle['remaining'] -= 1
-                        current_batch = []
-                        break
+def warm_start_options(value=None):
+    # A request's "warm_start" value -> {'from': plan, 'freeze_before':
+    # minutes}, or None to plan from scratch
+    if value is None or value is False:
+        return None
+    options = {'from': None, 'freeze_before': None}
+    if isinstance(value, dict):
+        unknown = set(value) - set(options)
+        if unknown:
+            raise ValueError(f'Unknown warm_start options: {", ".join(sorted(unknown))}')
+        options.update(value)
+    elif value is not True:
+        raise ValueError('warm_start must be true, false or an object')
+    if options['from'] is not None and not is_valid_plan_name(options['from']):
+        raise ValueError(f'Invalid plan name: {options["from"]!r}')
+    if options['freeze_before'] is not None:
+        try:
+            options['freeze_before'] = parse_clock(options['freeze_before'])
+        except (AttributeError, ValueError):
+            raise ValueError('warm_start freeze_before must be a time like "11:00"') from None
+    return options
 
-    for trip in trips:
-        points = [(STORE_LAT, STORE_LON)] + [(s['lat'], s['lon']) for s in trip['shipments']]
-        path = tsp_nearest_neighbor(points)
-        shipment_indices = path[1:-1]
-        ordered_shipments = [trip['shipments'][i-1] for i in shipment_indices]
-        trip['shipments'] = ordered_shipments
-
-    output_data = []
-    for idx, trip in enumerate(trips):
-        trip_time = (trip['mst_dist'] * 5) + (len(trip['shipments']) * 10)
-        available_time = trip['end'] - trip['start']
-        time_uti = trip_time / available_time if available_time != 0 else 0
-        capacity_uti = len(trip['shipments']) / trip['vehicle_capacity']
-        cov_uti = trip['mst_dist'] / trip['vehicle_max_radius'] if trip['vehicle_max_radius'] != float('inf') else 'N/A'
-        
-        for shipment in trip['shipments']:
-            output_data.append({
-                'TRIP_ID': f'T{(idx+1):03}_1',
-                'Shipment_ID': shipment['id'],
-                'Latitude': shipment['lat'],
-                'Longitude': shipment['lon'],
-                'TIME_SLOT': f"{int(shipment['start']/60):02d}:00-{int(shipment['end']/60):02d}:00",
-                'Shipments': len(trip['shipments']),
-                'MST_DIST': round(trip['mst_dist'], 2),
-                'TRIP_TIME': round(trip_time, 2),
-                'Vehicle_Type': trip['vehicle'],
-                'CAPACITY_UTI': round(capacity_uti, 2),
-                'TIME_UTI': round(time_uti, 2),
-                'COV_UTI': round(cov_uti, 2) if isinstance(cov_uti, (int, float)) else cov_uti
-            })
-
-    # Save output to CSV for map visualization
-    pd.DataFrame(output_data).to_csv("smartroute_output.csv", index=False)
-    print(output_data)
-    return output_data
+def optimize_and_store(shipments_data, plan=DEFAULT_PLAN, parallel=False, progress=None, local_search=None,
+                       fleet=None, warm_start=None):
+    # Save output to the trip store for the trip and map endpoints, with the
+    # shipment table and fleet so the plan can be changed incrementally.
+    # Returns the stored plan
+    options = warm_start_options(warm_start)
+    if options:
+        stored = warm_start_plan(shipments_data, plan, options, local_search=local_search, fleet=fleet,
+                                 progress=progress)
+        if stored is not None:
+            return stored
+    route_plan, output_data = optimize_plan(shipments_data, parallel=parallel, progress=progress,
+                                            local_search=local_search, fleet=fleet)
+    # Later changes address the stored shipments by id
+    shipment_positions(route_plan.shipments)
+    # Not while a replan that has read the previous version is writing its
+    # edited copy, which would replace this plan
+    with replan_lock:
+        stored = trip_store.put(plan, output_data, shipments=route_plan.shipments,
+                                fleet=route_plan.fleet.to_dict())
+    distance_cache.save(min_unsaved=DISTANCE_CACHE_SAVE_EVERY)
+    return stored
+
+def warm_start_plan(shipments_data, plan, options, local_search=None, fleet=None, progress=None):
+    # Rolling horizon: the shipments are a later copy of the plan the
+    # options start from (this plan unless 'from' names another, e.g. the
+    # day before). Only the slots whose shipments differ are re-solved, with
+    # the vehicles the kept trips leave, so unchanged routes stay as they
+    # were. Slots starting before 'freeze_before' are kept whatever the new
+    # copy says, as their trips are already out. Returns the stored plan, or
+    # None if there is no plan with the same fleet to start from
+    source = options['from'] or plan
+    with replan_lock, phase('replan'):
+        stored = trip_store.get(source)
+        if stored is None or stored.shipments is None:
+            return None
+        if request_fleet(stored.fleet).to_dict() != request_fleet(fleet).to_dict():
+            logger.info("Plan %s has another fleet, planning %s from scratch", source, plan)
+            return None
+        if isinstance(shipments_data, ShipmentColumns):
+            table = shipments_data
+        else:
+            with phase('parse'):
+                table = read_records(shipments_data)
+        table, touched, counts = diff_columns(stored.shipments, table, options['freeze_before'])
+        updated, resolved, _ = resolve_changes(plan, stored, table, touched, local_search=local_search,
+                                               progress=progress)
+    distance_cache.save(min_unsaved=DISTANCE_CACHE_SAVE_EVERY)
+    metrics.inc('smartroute_warm_starts_total')
+    logger.info("Warm-started plan %s from %s: %d added, %d removed, %d moved, %d slot(s) re-solved", plan, source,
+                counts['added'], counts['removed'], counts['moved'], len(resolved))
+    return updated
+
+def _trips_in_rows(rows):
+    trips = {}
+    for row in rows:
+        trips.setdefault(row['TRIP_ID'], []).append(row)
+    return list(trips.values())
+
+def replan_shipments(plan=DEFAULT_PLAN, add=(), remove=(), move=(), version=None, local_search=None,
+                     progress=None):
+    # Applies shipment changes to a stored plan and re-solves only the time
+    # slots they touch (see resolve_changes)
+    with replan_lock, phase('replan'):
+        stored = trip_store.get(plan)
+        if stored is None:
+            raise ValueError(f'Plan not found: {plan!r}')
+        if stored.shipments is None:
+            raise ValueError(f'Plan {plan!r} was stored without its shipments, re-optimize it first')
+        if version is not None and version != stored.version:
+            raise PlanConflictError(f'Plan {plan!r} is at version {stored.version}, not {version}')
+
+        table, touched = edit_columns(stored.shipments, add=add, remove=remove, move=move)
+        updated, resolved, changed = resolve_changes(plan, stored, table, touched, local_search=local_search,
+                                                     progress=progress)
+    distance_cache.save(min_unsaved=DISTANCE_CACHE_SAVE_EVERY)
+    metrics.inc('smartroute_replan_total')
+    logger.info("Re-planned %d slot(s) of plan %s", len(resolved), plan)
+    return {
+        'plan': plan,
+        'version': updated.version,
+        'resolved_slots': resolved,
+        'trips': len(updated.by_trip),
+        'shipments': len(table),
+        'planned_shipments': len(updated.rows),
+        'rows': changed,
+    }
+
+def resolve_changes(plan, stored, table, touched, local_search=None, progress=None):
+    # Stores table, an edited copy of stored's shipments, as plan and
+    # re-solves only the (start, end) slots in touched. Batching within a
+    # slot is sequential, so trips that were committed before the first
+    # changed shipment are kept and the slot is solved from there on.
+    # Vehicles are whatever the rest of the plan leaves; other slots are not
+    # re-solved to use vehicles a change frees up. Callers hold replan_lock.
+    # Returns (stored plan, labels of the re-solved slots, their rows)
+    old_table = stored.shipments
+    ordering = SLOT_ORDERING
+    fleet = request_fleet(stored.fleet)
+    old_groups, old_store_of, _ = plan_groups(old_table, fleet, ordering)
+    groups, _, store_dist = plan_groups(table, fleet, ordering)
+
+    # Stored trips by store and slot, in plan order
+    old_positions = shipment_positions(old_table)
+    old_start = old_table.start.tolist()
+    old_end = old_table.end.tolist()
+    slot_trips = {}
+    for trip_rows in stored.by_trip.values():
+        row = old_positions[str(trip_rows[0]['Shipment_ID'])]
+        slot_trips.setdefault((old_store_of[row], old_start[row], old_end[row]), []).append(trip_rows)
+
+    # A touched slot is re-checked at every store, since a moved shipment
+    # may now be nearer another one
+    budgets = [store.budget() for store in fleet.stores]
+    by_type = [{vehicle['type']: vehicle for vehicle in vehicles} for vehicles in budgets]
+    def spend(s, trips):
+        for trip_rows in trips:
+            by_type[s][trip_rows[0]['Vehicle_Type']]['remaining'] -= 1
+
+    for key, trips in slot_trips.items():
+        if key[1:] not in touched:
+            spend(key[0], trips)
+
+    def identity(tbl, rows):
+        return [(str(tbl.ids[i]), tbl.lat[i], tbl.lon[i]) for i in rows.tolist()]
+
+    resumed = {}
+    for key in groups:
+        if key[1:] not in touched:
+            continue
+        old_rows = old_groups.get(key, np.empty(0, dtype=np.int64))
+        old_ids = identity(old_table, old_rows)
+        new_ids = identity(table, groups[key])
+        first_change = next((i for i, (a, b) in enumerate(zip(old_ids, new_ids)) if a != b),
+                            min(len(old_ids), len(new_ids)))
+        # The slot's last trip may have been committed after the loop
+        # ran out of shipments, so it is never kept, and a trip that
+        # looked one shipment ahead before committing is only kept if
+        # that shipment did not change either. Trips are only kept up to
+        # a point where they cover every earlier shipment, which
+        # inter-trip local search may have broken
+        slot_pos = {shipment: i for i, (shipment, _, _) in enumerate(old_ids)}
+        kept, pending, covered, resume_at = [], [], 0, 0
+        for trip_rows in slot_trips.get(key, [])[:-1]:
+            last = max(slot_pos[str(row['Shipment_ID'])] for row in trip_rows)
+            if last + 1 >= first_change:
+                break
+            pending.append(trip_rows)
+            covered += len(trip_rows)
+            if covered == last + 1:
+                kept.extend(pending)
+                pending = []
+                resume_at = last + 1
+        spend(key[0], kept)
+        resumed[key] = (kept, resume_at)
+    prepare_distances(table, {key: groups[key] for key in resumed}, fleet)
+
+    options = local_search_options(local_search)
+    rows = []
+    changed = []
+    trip_count = 0
+    for done, key in enumerate(groups, 1):
+        if key in resumed:
+            kept, resume_at = resumed[key]
+            indices = groups[key][resume_at:]
+            solved = solve_timeslot(key[1], key[2], indices, table.lat[indices], table.lon[indices],
+                                    budgets[key[0]], fill=ordering == 'sweep', store=fleet.stores[key[0]],
+                                    fleet=fleet, store_dist=store_dist[indices])
+            if options:
+                solved = improve_trips(solved, table, options['budget'] / len(resumed), options['inter_trip'])
+            trips = kept + _trips_in_rows(RoutePlan(table, solved, fleet).to_rows())
+        else:
+            trips = slot_trips.get(key, [])
+        slot_rows = []
+        for trip_rows in trips:
+            name = trip_id(trip_count)
+            trip_count += 1
+            slot_rows.extend(row if row['TRIP_ID'] == name else {**row, 'TRIP_ID': name} for row in trip_rows)
+        rows.extend(slot_rows)
+        if key in resumed:
+            changed.extend(slot_rows)
+        if progress:
+            progress(done, len(groups))
+
+    updated = trip_store.put(plan, rows, shipments=table, fleet=stored.fleet)
+    resolved = [slot_label(*key[1:]) if len(fleet.stores) == 1 else f'{fleet.stores[key[0]].id}/{slot_label(*key[1:])}'
+                for key in resumed]
+    return updated, resolved, changed
+
+def submit_optimize(request_data):
+    plan = request_data.get('plan', DEFAULT_PLAN)
+    if not is_valid_plan_name(plan):
+        raise ValueError(f'Invalid plan name: {plan!r}')
+    local_search_options(request_data.get('local_search'))
+    warm_start_options(request_data.get('warm_start'))
+    fleet = request_fleet(request_data.get('fleet'))
+    return job_queue.submit(optimize_and_store, request_data['shipments'], plan=plan,
+                            parallel=bool(request_data.get('parallel', False)),
+                            local_search=request_data.get('local_search'), fleet=fleet,
+                            warm_start=request_data.get('warm_start'),
+                            profile=bool(request_data.get('profile', False)))
+
+def plan_response(stored, request, params=None):
+    # A stored plan in the view, format, filters and page the query asks for
+    # (see responses.py), compressed if the client accepts it
+    options = response_options(request.query_params if params is None else params)
+    body, media_type, headers = plan_body(stored, options, request.headers.get('accept-encoding'))
+    if isinstance(body, bytes):
+        return Response(body, media_type=media_type, headers=headers)
+    return StreamingResponse(body, media_type=media_type, headers=headers)
 
 @app.post("/optimize")
 async def optimize_route(request: Request):
@@ -225,77 +304,280 @@ async def optimize_route(request: Request):
         if not shipments:
             return JSONResponse(content={'error': 'No shipments data provided'}, status_code=400)
         
-        print(f"Received shipments data: {shipments}")
+        logger.debug("Received shipments data: %s", shipments)
+        response_options(request.query_params)
         
         # No need for additional processing here - pass the shipments directly to optimize_routes
-        output_data = optimize_routes(shipments)
-        return JSONResponse(content=output_data)
+        job = submit_optimize(request_data)
+        stored = await asyncio.wrap_future(job.future)
+        # Large plans are encoded off the event loop
+        response = await run_in_threadpool(plan_response, stored, request)
+        # The job id leads to /jobs/{job_id}/profile for profiled requests
+        response.headers['X-Job-Id'] = job.id
+        return response
         
+    except QueueFullError as e:
+        return JSONResponse(content={'error': str(e)}, status_code=429)
+    except PlanConflictError as e:
+        return JSONResponse(content={'error': str(e)}, status_code=409)
+    except ValueError as e:
+        return JSONResponse(content={'error': str(e)}, status_code=400)
     except Exception as e:
         return JSONResponse(content={'error': str(e)}, status_code=500)
 
-def load_trips():
+@app.post("/jobs/optimize")
+async def submit_optimize_job(request: Request):
     try:
-        # Check if file exists and is not empty
-        if os.path.exists("smartroute_output.csv") and os.path.getsize("smartroute_output.csv") > 0:
-            df = pd.read_csv("smartroute_output.csv")
-            return df.to_dict(orient="records")
-        else:
-            return []
+        request_data = await request.json()
+        shipments = request_data.get('shipments', [])
+
+        if not shipments:
+            return JSONResponse(content={'error': 'No shipments data provided'}, status_code=400)
+
+        job = submit_optimize(request_data)
+        return JSONResponse(content=job.to_dict(), status_code=202)
+
+    except QueueFullError as e:
+        return JSONResponse(content={'error': str(e)}, status_code=429)
+    except ValueError as e:
+        return JSONResponse(content={'error': str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse(content={'error': str(e)}, status_code=500)
+
+@app.post("/jobs/optimize/upload")
+async def submit_optimize_upload(request: Request, format: str = 'ndjson', plan: str = DEFAULT_PLAN,
+                                 parallel: bool = False, warm_start: bool = False, freeze_before: str = None):
+    # Streams an NDJSON or CSV body straight into column arrays
+    try:
+        parser = ShipmentParser(format)
+        async for chunk in request.stream():
+            parser.feed(chunk)
+        shipments = parser.close()
+
+        if not len(shipments):
+            return JSONResponse(content={'error': 'No shipments data provided'}, status_code=400)
+
+        job = submit_optimize({'shipments': shipments, 'plan': plan, 'parallel': parallel,
+                               'warm_start': {'freeze_before': freeze_before} if warm_start else None})
+        return JSONResponse(content=job.to_dict(), status_code=202)
+
+    except QueueFullError as e:
+        return JSONResponse(content={'error': str(e)}, status_code=429)
+    except ValueError as e:
+        return JSONResponse(content={'error': str(e)}, status_code=400)
     except Exception as e:
-        print(f"Error loading trips: {e}")
-        return []
+        return JSONResponse(content={'error': str(e)}, status_code=500)
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        return JSONResponse(content={'error': 'Job not found'}, status_code=404)
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str, request: Request):
+    job = job_queue.get(job_id)
+    if job is None:
+        return JSONResponse(content={'error': 'Job not found'}, status_code=404)
+    if job.status == 'failed':
+        return JSONResponse(content=job.to_dict(), status_code=500)
+    if job.status != 'done':
+        return JSONResponse(content=job.to_dict(), status_code=202)
+    # Pages of a job's result stay readable after the plan changes again
+    try:
+        return plan_response(job.result, request)
+    except PlanConflictError as e:
+        return JSONResponse(content={'error': str(e)}, status_code=409)
+    except ValueError as e:
+        return JSONResponse(content={'error': str(e)}, status_code=400)
+
+@app.get("/jobs/{job_id}/profile")
+def get_job_profile(job_id: str):
+    # Collapsed stacks ("frame;frame;frame samples") for jobs submitted with
+    # "profile": true, ready for flamegraph.pl or speedscope
+    job = job_queue.get(job_id)
+    if job is None:
+        return JSONResponse(content={'error': 'Job not found'}, status_code=404)
+    if job.profile is None:
+        status_code = 404 if job.status in ('done', 'failed') else 202
+        return JSONResponse(content={'error': 'No profile for this job'}, status_code=status_code)
+    return PlainTextResponse(job.profile)
+
+@app.get("/metrics")
+def get_metrics():
+    cache = map_cache.stats()
+    distances = distance_cache.stats()
+    gauges = {
+        'smartroute_jobs_pending': ('Optimization jobs queued or running', job_queue.pending()),
+        'smartroute_plans': ('Plans in the trip store', len(trip_store.names())),
+        'smartroute_map_cache_entries': ('Rendered maps cached', cache['entries']),
+        'smartroute_map_cache_bytes': ('Size of the cached map HTML', cache['bytes']),
+        'smartroute_map_cache_hits': ('Map cache hits', cache['hits']),
+        'smartroute_map_cache_misses': ('Map cache misses', cache['misses']),
+        'smartroute_distance_cache_entries': ('Point pairs in the distance cache', distances['entries']),
+        'smartroute_distance_cache_disk_entries': ('Point pairs in the on-disk distance cache',
+                                                   distances['disk_entries']),
+    }
+    return PlainTextResponse(metrics.render(gauges), media_type='text/plain; version=0.0.4')
+
+def import_legacy_trips(path="smartroute_output.csv"):
+    # Plans saved by older versions of the server become the default plan
+    try:
+        if trip_store.get(DEFAULT_PLAN) is None and os.path.exists(path) and os.path.getsize(path) > 0:
+            trip_store.put(DEFAULT_PLAN, pd.read_csv(path).to_dict(orient="records"))
+    except Exception as e:
+        logger.warning("Error loading trips: %s", e)
+
+import_legacy_trips()
+
+@app.on_event("shutdown")
+def save_distance_cache():
+    distance_cache.save()
+
+@app.get("/api/plans")
+def get_plans():
+    return trip_store.names()
 
 @app.get("/api/trips")
-def get_trips():
-    return load_trips()
+def get_trips(request: Request, plan: str = DEFAULT_PLAN, view: str = 'rows', format: str = 'json',
+              slot: str = None, vehicle: str = None, limit: int = None, cursor: str = None):
+    # Without parameters, every row of the plan as a list. view=trips nests
+    # the shipments under their trip; slot and vehicle filter trips; limit
+    # and cursor page through them; format=ndjson streams one item per line
+    params = {'view': view, 'format': format, 'slot': slot, 'vehicle': vehicle, 'limit': limit, 'cursor': cursor}
+    try:
+        stored = trip_store.get(plan) if is_valid_plan_name(plan) else None
+        if stored is None and not is_legacy(response_options(params)):
+            return JSONResponse(content={'error': 'Plan not found'}, status_code=404)
+        return plan_response(stored, request, params)
+    except PlanConflictError as e:
+        return JSONResponse(content={'error': str(e)}, status_code=409)
+    except ValueError as e:
+        return JSONResponse(content={'error': str(e)}, status_code=400)
 
-@app.get("/api/map/{trip_id}", response_class=HTMLResponse)
-def get_trip_map(trip_id: str):
-    trips = load_trips()
-    selected_trip = [trip for trip in trips if trip["TRIP_ID"] == trip_id]
-    
-    if not selected_trip:
-        return HTMLResponse(content="<h1>Trip not found</h1>", status_code=404)
-    
+async def replan_response(plan, changes):
+    try:
+        if not is_valid_plan_name(plan) or trip_store.get(plan) is None:
+            return JSONResponse(content={'error': 'Plan not found'}, status_code=404)
+        if not isinstance(changes, dict):
+            raise ValueError('Expected a JSON object')
+        for key in ('add', 'remove', 'move'):
+            if not isinstance(changes.get(key, []), list):
+                raise ValueError(f'{key!r} must be a list')
+        local_search_options(changes.get('local_search'))
+        job = job_queue.submit(replan_shipments, plan, add=changes.get('add', []), remove=changes.get('remove', []),
+                               move=changes.get('move', []), version=changes.get('version'),
+                               local_search=changes.get('local_search'))
+        result = await asyncio.wrap_future(job.future)
+        return JSONResponse(content=result)
+
+    except QueueFullError as e:
+        return JSONResponse(content={'error': str(e)}, status_code=429)
+    except PlanConflictError as e:
+        return JSONResponse(content={'error': str(e)}, status_code=409)
+    except ValueError as e:
+        return JSONResponse(content={'error': str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse(content={'error': str(e)}, status_code=500)
+
+@app.patch("/api/plans/{plan}/shipments")
+async def patch_plan_shipments(plan: str, request: Request):
+    # Body: {"add": [shipment, ...], "remove": [shipment_id, ...],
+    #        "move": [{"shipment_id": ..., "delivery_timeslot"/"latitude"/"longitude": ...}],
+    #        "version": optional, rejected with 409 unless it is the plan's current version}
+    try:
+        changes = await request.json()
+    except ValueError as e:
+        return JSONResponse(content={'error': str(e)}, status_code=400)
+    return await replan_response(plan, changes)
+
+@app.delete("/api/plans/{plan}/shipments/{shipment_id}")
+async def delete_plan_shipment(plan: str, shipment_id: str):
+    return await replan_response(plan, {'remove': [shipment_id]})
+
+def plan_stores(stored):
+    # {store id: (lat, lon)} of a stored plan's fleet
+    return {store.id: store.location for store in request_fleet(stored.fleet).stores}
+
+def row_store(row, stores=None):
+    # Location of the store a plan row's trip leaves from; rows only name
+    # their store in multi-store plans
+    if not stores:
+        return (STORE_LAT, STORE_LON)
+    return stores.get(row.get('STORE_ID')) or next(iter(stores.values()))
+
+def render_trip_map(selected_trip, mode='markers', stores=None):
     # Extract route locations
-    store_location = (STORE_LAT, STORE_LON)
+    store_location = row_store(selected_trip[0], stores)
     shipment_locations = [(float(trip["Latitude"]), float(trip["Longitude"])) for trip in selected_trip]
     
     # Create Folium map
     m = folium.Map(location=store_location, zoom_start=12)
     folium.Marker(store_location, popup="Store Location", icon=folium.Icon(color="green")).add_to(m)
     
-    for loc in shipment_locations:
-        folium.Marker(loc, popup="Shipment", icon=folium.Icon(color="blue")).add_to(m)
-    
-    route_points = [store_location] + shipment_locations + [store_location]
-    folium.PolyLine(route_points, color="blue").add_to(m)
+    if mode == 'geojson':
+        trip_layer(selected_trip, {selected_trip[0]['TRIP_ID']: 'blue'}, stores).add_to(m)
+    else:
+        for loc in shipment_locations:
+            folium.Marker(loc, popup="Shipment", icon=folium.Icon(color="blue")).add_to(m)
+        
+        route_points = [store_location] + shipment_locations + [store_location]
+        folium.PolyLine(route_points, color="blue").add_to(m)
     
     # Save map as HTML and return it
-    map_html = m._repr_html_()
-    return HTMLResponse(content=map_html)
+    return m._repr_html_()
 
+def trip_layer(trips, trip_colors, stores=None):
+    # One GeoJSON FeatureCollection with a point per shipment and a line per
+    # route, instead of a Marker/PolyLine element per feature
+    features = []
+    routes = {}
+    for trip in trips:
+        trip_id = trip['TRIP_ID']
+        coords = [float(trip['Longitude']), float(trip['Latitude'])]
+        if trip_id not in routes:
+            store_lat, store_lon = row_store(trip, stores)
+            routes[trip_id] = (trip['TIME_SLOT'], [[store_lon, store_lat]])
+        routes[trip_id][1].append(coords)
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': coords},
+            'properties': {'trip': trip_id, 'shipment': str(trip['Shipment_ID']), 'slot': trip['TIME_SLOT'],
+                           'color': CSS_COLORS.get(trip_colors[trip_id], trip_colors[trip_id])},
+        })
+    for trip_id, (slot, route) in routes.items():
+        route.append(route[0])
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'LineString', 'coordinates': route},
+            'properties': {'trip': trip_id, 'shipment': '', 'slot': slot,
+                           'color': CSS_COLORS.get(trip_colors[trip_id], trip_colors[trip_id])},
+        })
+    return folium.GeoJson(
+        {'type': 'FeatureCollection', 'features': features},
+        marker=folium.CircleMarker(radius=5, fill=True, fill_opacity=0.8),
+        style_function=lambda feature: {
+            'color': feature['properties']['color'],
+            'fillColor': feature['properties']['color'],
+            'weight': 2,
+            'opacity': 0.8,
+        },
+        tooltip=folium.GeoJsonTooltip(fields=['trip', 'shipment', 'slot'], aliases=['Trip', 'Shipment', 'Timeslot']),
+    )
 
-@app.get("/api/all-trips-map", response_class=HTMLResponse)
-def get_all_trips_map():
-    trips = load_trips()
+def render_all_trips_map(trips, mode='markers', stores=None):
+    # Create Folium map centered on the (first) store
+    store_locations = list(stores.values()) if stores else [(STORE_LAT, STORE_LON)]
+    m = folium.Map(location=store_locations[0], zoom_start=10)
     
-    if not trips:
-        return HTMLResponse(content="<h1>No trips found</h1>", status_code=404)
-    
-    # Store location (fixed)
-    store_location = (STORE_LAT, STORE_LON)
-    
-    # Create Folium map centered on store location
-    m = folium.Map(location=store_location, zoom_start=10)
-    
-    # Add store marker
-    folium.Marker(
-        store_location, 
-        popup="Store Location", 
-        icon=folium.Icon(color="green", icon="home")
-    ).add_to(m)
+    # Add store markers
+    for store_location in store_locations:
+        folium.Marker(
+            store_location, 
+            popup="Store Location", 
+            icon=folium.Icon(color="green", icon="home")
+        ).add_to(m)
     
     # Color palette for different trips
     colors = ['blue', 'red', 'purple', 'orange', 'darkred', 'lightred', 'beige', 'darkblue', 'darkgreen', 'cadetblue']
@@ -304,15 +586,20 @@ def get_all_trips_map():
     color_index = 0
     trip_colors = {}
     
+    # Assign a consistent color to each trip
+    for trip in trips:
+        if trip['TRIP_ID'] not in trip_colors:
+            trip_colors[trip['TRIP_ID']] = colors[color_index % len(colors)]
+            color_index += 1
+    
+    if mode == 'geojson':
+        trip_layer(trips, trip_colors, stores).add_to(m)
+        return m._repr_html_()
+    
     # Add trips to map
     for trip in trips:
         trip_id = trip['TRIP_ID']
         
-        # Assign a consistent color to each trip
-        if trip_id not in trip_colors:
-            trip_colors[trip_id] = colors[color_index % len(colors)]
-            color_index += 1
-        
         # Create marker for shipment
         folium.Marker(
             location=[float(trip['Latitude']), float(trip['Longitude'])],
@@ -325,12 +612,12 @@ def get_all_trips_map():
     for trip in trips:
         trip_id = trip['TRIP_ID']
         if trip_id not in trip_routes:
-            trip_routes[trip_id] = [store_location]
+            trip_routes[trip_id] = [row_store(trip, stores)]
         trip_routes[trip_id].append((float(trip['Latitude']), float(trip['Longitude'])))
     
     # Draw routes for each trip
     for trip_id, route in trip_routes.items():
-        route.append(store_location)
+        route.append(route[0])
         folium.PolyLine(
             route, 
             color=trip_colors.get(trip_id, 'blue'), 
@@ -340,7 +627,35 @@ def get_all_trips_map():
         ).add_to(m)
     
     # Save map as HTML and return it
-    map_html = m._repr_html_()
+    return m._repr_html_()
+
+
+@app.get("/api/map/{trip_id}", response_class=HTMLResponse)
+def get_trip_map(trip_id: str, plan: str = DEFAULT_PLAN, mode: str = 'markers'):
+    if mode not in MAP_MODES:
+        return HTMLResponse(content="<h1>Unknown map mode</h1>", status_code=400)
+    stored = trip_store.get(plan)
+    selected_trip = stored.trip(trip_id) if stored else []
+    
+    if not selected_trip:
+        return HTMLResponse(content="<h1>Trip not found</h1>", status_code=404)
+    
+    map_html = map_cache.get_or_render((plan, stored.version, trip_id, mode),
+                                       lambda: render_trip_map(selected_trip, mode, plan_stores(stored)))
+    return HTMLResponse(content=map_html)
+
+
+@app.get("/api/all-trips-map", response_class=HTMLResponse)
+def get_all_trips_map(plan: str = DEFAULT_PLAN, mode: str = 'markers'):
+    if mode not in MAP_MODES:
+        return HTMLResponse(content="<h1>Unknown map mode</h1>", status_code=400)
+    stored = trip_store.get(plan)
+    
+    if not stored or not stored.rows:
+        return HTMLResponse(content="<h1>No trips found</h1>", status_code=404)
+    
+    map_html = map_cache.get_or_render((plan, stored.version, None, mode),
+                                       lambda: render_all_trips_map(stored.rows, mode, plan_stores(stored)))
     return HTMLResponse(content=map_html)
 
 @app.get("/")
@@ -348,6 +663,7 @@ def index():
     return HTMLResponse(content='''
     <h1>SmartRoute Optimization API</h1>
     <p>Send POST request to /optimize with shipments data</p>
+    <p>For large plans, POST the same body to /jobs/optimize and poll /jobs/{job_id} and /jobs/{job_id}/result</p>
     <h2>Example JSON Format:</h2>
     <pre>
 {
@@ -364,4 +680,5 @@ def index():
     ''')
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get('SMARTROUTE_LOG_LEVEL', 'INFO'))
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
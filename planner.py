@@ -0,0 +1,540 @@
+# Route planning engine: batches each time slot's shipments into vehicle
+# trips and orders every trip's stops.
+#
+# Importing it has no side effects beyond reading its configuration from the
+# environment. The API (new.py), batch workers (batch.py) and the slot pool's
+# worker processes all plan through this module.
+import math
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from mst import IncrementalMST
+from distance import HaversineDistances, points_to_arrays
+from distance_cache import DistanceCache
+from ingest import ShipmentColumns, read_records
+from model import RoutePlan, Trip, timeslot_groups
+from instrumentation import metrics, phase
+from local_search import improve_slot, improve_tour, tour_length
+from clustering import order_groups
+from fleet import fleet_config, load_fleet
+from road_graph import RoadDistances
+
+logger = logging.getLogger('smartroute')
+
+# Stores, vehicles and trip time model used when a request sends no
+# "fleet" (see fleet.py); SMARTROUTE_FLEET names a JSON file in that format
+DEFAULT_FLEET = load_fleet(os.environ['SMARTROUTE_FLEET']) if os.environ.get('SMARTROUTE_FLEET') else fleet_config()
+
+# Order of each slot's shipments before batching. 'sweep' walks them by
+# bearing around the store so that consecutive shipments are close, and
+# keeps filling a vehicle while the next shipment still fits it. 'arrival'
+# is upload order, committing as soon as any vehicle fits.
+SLOT_ORDERING = os.environ.get('SMARTROUTE_SLOT_ORDERING', 'sweep')
+
+# Wall-clock budget per request of the local search that shortens trip
+# tours after planning, and whether it may also move stops between trips of
+# a time slot. Requests override them with "local_search": {"budget_ms": ...,
+# "inter_trip": ...}, or skip the stage with "local_search": false
+LOCAL_SEARCH_BUDGET_MS = float(os.environ.get('SMARTROUTE_LOCAL_SEARCH_MS', 200))
+LOCAL_SEARCH_INTER_TRIP = os.environ.get('SMARTROUTE_LOCAL_SEARCH_INTER_TRIP', '0') == '1'
+
+# Worker processes used by optimize_routes(parallel=True), one slot per task.
+# They are started from a fork server (spawned where there is none), not
+# forked from a job thread that may share the process with threads holding
+# the metrics, distance cache or logging locks
+SLOT_POOL_WORKERS = int(os.environ.get('SMARTROUTE_SLOT_WORKERS', os.cpu_count() or 1))
+SLOT_POOL_START = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+_slot_pool = None
+_slot_pool_lock = threading.Lock()
+
+# Road network distances instead of straight lines: SMARTROUTE_ROAD_GRAPH is
+# a graph directory built by road_graph.py, SMARTROUTE_ROAD_TABLE_DIR where
+# the per-slot distance tables shared with the slot pool are written
+# (default: tables/ in the graph directory)
+if os.environ.get('SMARTROUTE_ROAD_GRAPH'):
+    distance_provider = RoadDistances(os.environ['SMARTROUTE_ROAD_GRAPH'],
+                                      os.environ.get('SMARTROUTE_ROAD_TABLE_DIR') or None)
+else:
+    distance_provider = HaversineDistances()
+
+# Distances between (quantized) coordinates, shared by every solve in the
+# process so re-submitted addresses are not measured again. With
+# SMARTROUTE_DISTANCE_CACHE_DIR set they are also kept on disk, saved by the
+# caller once this many new pairs have piled up. 0 entries disables it,
+# the default for straight-line distances: the vectorized haversine is
+# cheaper than looking its pairs up
+distance_cache = DistanceCache(
+    max_entries=int(os.environ.get('SMARTROUTE_DISTANCE_CACHE_ENTRIES',
+                                   250_000 if isinstance(distance_provider, RoadDistances) else 0)),
+    directory=os.environ.get('SMARTROUTE_DISTANCE_CACHE_DIR') or None,
+    provider=distance_provider,
+)
+DISTANCE_CACHE_SAVE_EVERY = 50_000
+
+def compute_mst(points):
+    metrics.inc('smartroute_compute_mst_total')
+    n = len(points)
+    dist_matrix = distance_cache.matrix(*points_to_arrays(points))
+    rows, cols = np.triu_indices(n, k=1)
+    weights = dist_matrix[rows, cols]
+    order = np.argsort(weights, kind='stable')
+    edges = zip(weights[order].tolist(), rows[order].tolist(), cols[order].tolist())
+    parent = list(range(n))
+    def find(u):
+        while parent[u] != u:
+            parent[u] = parent[parent[u]]
+            u = parent[u]
+        return u
+    def union(u, v):
+        u_root = find(u)
+        v_root = find(v)
+        if u_root != v_root:
+            parent[v_root] = u_root
+    mst_sum = 0
+    mst_edges = []
+    for edge in edges:
+        dist, u, v = edge
+        if find(u) != find(v):
+            union(u, v)
+            mst_sum += dist
+            mst_edges.append(edge)
+            if len(mst_edges) == n - 1:
+                break
+    return mst_sum
+
+def tsp_nearest_neighbor(points, dist_matrix=None):
+    metrics.inc('smartroute_tsp_total')
+    n = len(points)
+    if dist_matrix is None:
+        dist_matrix = distance_cache.matrix(*points_to_arrays(points))
+    visited = np.zeros(n, dtype=bool)
+    path = [0]
+    visited[0] = True
+    current = 0
+    for _ in range(n - 1):
+        dists = np.where(visited, np.inf, dist_matrix[current])
+        nearest_idx = int(np.argmin(dists))
+        if visited[nearest_idx]:
+            break
+        path.append(nearest_idx)
+        visited[nearest_idx] = True
+        current = nearest_idx
+    path.append(0)
+    return path
+
+def solve_timeslot(start_time, end_time, indices, lats, lons, vehicles, fill=False, store=None, fleet=None,
+                   store_dist=None):
+    # Packs one time slot into trips, spending the vehicles' remaining counts.
+    # indices are the slot's rows in the shipment table and lats/lons their
+    # coordinates; the batch itself holds positions within the slot. With
+    # fill, a batch that fits a vehicle keeps growing while the next shipment
+    # would still fit that vehicle. store_dist, if already known, is every
+    # shipment's distance from the store
+    slot_start = time.perf_counter()
+    fleet = fleet or DEFAULT_FLEET
+    store = store or fleet.stores[0]
+    if store_dist is None:
+        store_dist = distance_cache.to_point(lats, lons, store.lat, store.lon)
+    store_dist = np.asarray(store_dist)
+    lats = np.asarray(lats).tolist()
+    lons = np.asarray(lons).tolist()
+    trips = []
+    current_batch = []
+    batch_mst = IncrementalMST(store.location, distances=distance_cache.to_point)
+
+    # The MST always reaches at least as far as the farthest shipment from
+    # the store, so a batch holding a shipment outside a vehicle's radius
+    # can never fit that vehicle
+    in_radius = {
+        vehicle['type']: set(np.flatnonzero(store_dist <= vehicle['max_radius']).tolist())
+        for vehicle in vehicles if vehicle['max_radius'] != float('inf')
+    }
+    out_of_radius = set()
+    available_time = end_time - start_time
+    # Fewest shipments each vehicle leaves with, and the fewest of any
+    min_loads = {vehicle['type']: math.ceil(vehicle['capacity'] * fleet.min_load) for vehicle in vehicles}
+    min_load = min(min_loads.values(), default=0)
+    # The same bound in km: the MST is at least as long as the batch's
+    # farthest shipment from the store (less a metre for rounding)
+    reach = 0.0
+    lookahead = None
+    checks = 0
+
+    def first_fit(mst_dist, leftover=False):
+        # The first vehicle in fleet order the batch fits, from the state
+        # computed once per batch; the leftover batch only has to fit
+        # capacity and radius
+        nonlocal checks
+        n = len(current_batch)
+        if not leftover and n < min_load:
+            return None
+        for vehicle in vehicles:
+            if vehicle['remaining'] <= 0 or vehicle['type'] in out_of_radius:
+                continue
+            checks += 1
+            if n > vehicle['capacity'] or mst_dist > vehicle['max_radius']:
+                continue
+            if leftover or (n >= min_loads[vehicle['type']] and fleet.trip_time(mst_dist, n) <= available_time):
+                return vehicle
+        return None
+
+    def fits_next(vehicle, pos):
+        # Whether the batch plus the next shipment would still fit vehicle.
+        # The MST with that shipment is kept for the next step, which then
+        # does not add it again
+        nonlocal lookahead
+        nxt = pos + 1
+        n = len(current_batch) + 1
+        if nxt == len(lats) or n > vehicle['capacity']:
+            return False
+        if vehicle['type'] in in_radius and nxt not in in_radius[vehicle['type']]:
+            return False
+        if fleet.trip_time(max(reach, store_dist[nxt] - 0.001), n) > available_time:
+            return False
+        forked = batch_mst.fork()
+        mst_dist = forked.add(lats[nxt], lons[nxt])
+        lookahead = (nxt, forked)
+        if mst_dist > vehicle['max_radius']:
+            return False
+        return fleet.trip_time(mst_dist, n) <= available_time
+    
+    def can_grow():
+        # A batch only grows, and its radius exclusions only accumulate, so
+        # once no vehicle left can hold it no later shipment forms a trip
+        n = len(current_batch)
+        return any(vehicle['remaining'] > 0 and vehicle['type'] not in out_of_radius and n <= vehicle['capacity']
+                   for vehicle in vehicles)
+
+    mst_seconds = 0.0
+    mst_updates = 0
+    for pos in range(len(lats)):
+        current_batch.append(pos)
+        mst_start = time.perf_counter()
+        if lookahead is not None and lookahead[0] == pos:
+            batch_mst = lookahead[1]
+            mst_dist = batch_mst.total
+        else:
+            mst_dist = batch_mst.add(lats[pos], lons[pos])
+            mst_updates += 1
+        lookahead = None
+        mst_seconds += time.perf_counter() - mst_start
+        reach = max(reach, store_dist[pos] - 0.001)
+        out_of_radius.update(vtype for vtype, members in in_radius.items() if pos not in members)
+
+        vehicle = first_fit(mst_dist)
+        if vehicle is None:
+            if not can_grow():
+                break
+            continue
+        if fill and fits_next(vehicle, pos):
+            mst_updates += 1
+            continue
+        trips.append(Trip(current_batch, start_time, end_time, mst_dist, vehicle['type'],
+                          vehicle['capacity'], vehicle['max_radius'], store=store, fleet=fleet))
+        vehicle['remaining'] -= 1
+        current_batch = []
+        batch_mst.reset()
+        out_of_radius.clear()
+        reach = 0.0
+        lookahead = None
+    
+    if current_batch:
+        mst_dist = batch_mst.total
+        vehicle = first_fit(mst_dist, leftover=True)
+        if vehicle is not None and fill and fleet.trip_time(mst_dist, len(current_batch)) > available_time:
+            # A sweep's last batch ends where the slot does, not where a
+            # vehicle filled up, so it only keeps the shipments it can
+            # deliver in time
+            batch_mst.reset()
+            for n, pos in enumerate(current_batch):
+                grown = batch_mst.fork()
+                mst_updates += 1
+                if fleet.trip_time(grown.add(lats[pos], lons[pos]), n + 1) > available_time:
+                    current_batch = current_batch[:n]
+                    break
+                batch_mst = grown
+            mst_dist = batch_mst.total
+            out_of_radius = {vtype for vtype, members in in_radius.items()
+                             if any(pos not in members for pos in current_batch)}
+            vehicle = first_fit(mst_dist, leftover=True) if current_batch else None
+        if vehicle is not None:
+            trips.append(Trip(current_batch, start_time, end_time, mst_dist, vehicle['type'],
+                              vehicle['capacity'], vehicle['max_radius'], store=store, fleet=fleet))
+            vehicle['remaining'] -= 1
+            current_batch = []
+
+    # Order each trip's stops and swap slot positions for table rows
+    tsp_start = time.perf_counter()
+    indices = np.asarray(indices).tolist()
+    for trip in trips:
+        points = [store.location] + [(lats[pos], lons[pos]) for pos in trip.shipments]
+        dist_matrix = distance_cache.matrix(*points_to_arrays(points))
+        path = tsp_nearest_neighbor(points, dist_matrix)
+        trip.shipments = [indices[trip.shipments[i-1]] for i in path[1:-1]]
+        trip.tour_dist = tour_length(dist_matrix, path[:-1])
+    slot_end = time.perf_counter()
+
+    # Timers are summed over the slot and recorded once, batching being
+    # everything that was not an MST update or tour
+    metrics.observe('smartroute_phase_seconds', mst_seconds, phase='mst')
+    metrics.observe('smartroute_phase_seconds', slot_end - tsp_start, phase='tsp')
+    metrics.observe('smartroute_phase_seconds', tsp_start - slot_start - mst_seconds, phase='batching')
+    metrics.observe('smartroute_slot_seconds', slot_end - slot_start)
+    metrics.inc('smartroute_mst_updates_total', mst_updates)
+    metrics.inc('smartroute_feasibility_checks_total', checks)
+    return trips
+
+def _solve_timeslot_job(start_time, end_time, indices, lats, lons, vehicles, fill=False, store=None, fleet=None,
+                        store_dist=None):
+    # Worker entry point; vehicles is the worker's own copy, so report how
+    # many of each type the slot's trips spent, and the metrics it recorded
+    before = metrics.snapshot()
+    trips = solve_timeslot(start_time, end_time, indices, lats, lons, vehicles, fill=fill, store=store, fleet=fleet,
+                           store_dist=store_dist)
+    spent = {vehicle['type']: 0 for vehicle in vehicles}
+    for trip in trips:
+        spent[trip.vehicle] += 1
+    return trips, spent, metrics.delta(before)
+
+def get_slot_pool():
+    global _slot_pool
+    with _slot_pool_lock:
+        if _slot_pool is None:
+            _slot_pool = ProcessPoolExecutor(max_workers=SLOT_POOL_WORKERS,
+                                              mp_context=multiprocessing.get_context(SLOT_POOL_START))
+        return _slot_pool
+
+def drop_slot_pool(pool):
+    # A worker died (killed, out of memory): the pool takes no more tasks,
+    # so the next request starts a new one
+    global _slot_pool
+    with _slot_pool_lock:
+        if _slot_pool is pool:
+            _slot_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def solve_timeslots_parallel(table, timeslot_groups, vehicles, progress=None, fill=False, store=None, fleet=None,
+                             store_dist=None):
+    # Solves every slot speculatively in the process pool with the budget left
+    # at the first unresolved slot, then reconciles in slot order. A slot that
+    # spent no more vehicles of each type than the serial run would have left
+    # for it saw exactly the same remaining > 0 checks, so its trips are the
+    # serial ones. The first slot that overspent starts the next wave with the
+    # reconciled budget; each wave resolves at least one slot. If the pool
+    # breaks, the slots left are solved here, as the serial run would.
+    slots = list(timeslot_groups.items())
+    resolved = []
+    pool = get_slot_pool()
+    try:
+        while len(resolved) < len(slots):
+            futures = [
+                pool.submit(_solve_timeslot_job, start_time, end_time, indices, table.lat[indices],
+                            table.lon[indices], vehicles, fill, store, fleet,
+                            None if store_dist is None else store_dist[indices])
+                for (start_time, end_time), indices in slots[len(resolved):]
+            ]
+            for future in futures:
+                slot_trips, spent, slot_metrics = future.result()
+                metrics.merge(slot_metrics)
+                if any(spent[vehicle['type']] > vehicle['remaining'] for vehicle in vehicles):
+                    break
+                for vehicle in vehicles:
+                    vehicle['remaining'] -= spent[vehicle['type']]
+                resolved.append(slot_trips)
+                if progress:
+                    progress(len(resolved), len(slots))
+            for future in futures:
+                future.cancel()
+    except BrokenProcessPool:
+        logger.warning("Slot pool broke, solving the last %d slot(s) in this process", len(slots) - len(resolved))
+        metrics.inc('smartroute_slot_pool_broken_total')
+        drop_slot_pool(pool)
+        for (start_time, end_time), indices in slots[len(resolved):]:
+            resolved.append(solve_timeslot(start_time, end_time, indices, table.lat[indices], table.lon[indices],
+                                           vehicles, fill=fill, store=store, fleet=fleet,
+                                           store_dist=None if store_dist is None else store_dist[indices]))
+            if progress:
+                progress(len(resolved), len(slots))
+    return [trip for slot_trips in resolved for trip in slot_trips]
+
+def local_search_options(value=None):
+    # A request's "local_search" value -> {'budget': seconds, 'inter_trip': bool},
+    # or None when the stage is off
+    if value is False:
+        return None
+    options = {'budget_ms': LOCAL_SEARCH_BUDGET_MS, 'inter_trip': LOCAL_SEARCH_INTER_TRIP}
+    if isinstance(value, dict):
+        unknown = set(value) - set(options)
+        if unknown:
+            raise ValueError(f'Unknown local_search options: {", ".join(sorted(unknown))}')
+        options.update(value)
+    elif value not in (None, True):
+        raise ValueError('local_search must be true, false or an object')
+    try:
+        budget = float(options['budget_ms']) / 1000
+    except (TypeError, ValueError):
+        raise ValueError('local_search budget_ms must be a number') from None
+    if budget <= 0:
+        return None
+    return {'budget': budget, 'inter_trip': bool(options['inter_trip'])}
+
+def trip_mst(trip, table, shipments):
+    # MST length of a trip holding these table rows, or None if its vehicle
+    # could not take them. A trip may be emptied, freeing its vehicle, but
+    # not shrunk below its vehicle's minimum load (a slot's last trip may
+    # have been planned below it, and then only may not shrink)
+    if len(shipments) > trip.vehicle_capacity:
+        return None
+    if shipments and len(shipments) < len(trip.shipments) and \
+            len(shipments) < math.ceil(trip.vehicle_capacity * trip.fleet.min_load):
+        return None
+    points = [trip.store.location] + list(zip(table.lat[shipments].tolist(), table.lon[shipments].tolist()))
+    mst_dist = compute_mst(points) if shipments else 0
+    if mst_dist > trip.vehicle_max_radius:
+        return None
+    if trip.fleet.trip_time(mst_dist, len(shipments)) > trip.end - trip.start:
+        return None
+    return mst_dist
+
+def reorder_trip(trip, table, deadline):
+    rows = trip.shipments
+    points = [trip.store.location] + list(zip(table.lat[rows].tolist(), table.lon[rows].tolist()))
+    dist_matrix = distance_cache.matrix(*points_to_arrays(points))
+    tour, trip.tour_dist = improve_tour(dist_matrix, list(range(len(points))), deadline)
+    trip.shipments = [trip.shipments[i-1] for i in tour[1:]]
+
+def improve_trips(trips, table, budget, inter_trip=False):
+    # Post-optimization stage: 2-opt/Or-opt on every tour, then optionally
+    # relocate/exchange moves between trips of a slot, all within `budget`
+    # seconds. Returns the trips, without any that inter-trip moves emptied
+    deadline = time.perf_counter() + budget
+    with phase('local_search'):
+        for trip in trips:
+            reorder_trip(trip, table, deadline)
+        if not inter_trip:
+            return trips
+
+        by_slot = {}
+        for trip in trips:
+            by_slot.setdefault((trip.store.id, trip.start, trip.end), []).append(trip)
+        for slot_trips in by_slot.values():
+            if len(slot_trips) < 2 or time.perf_counter() >= deadline:
+                continue
+            # Node 0 is the store, then every stop of the slot
+            rows = [row for trip in slot_trips for row in trip.shipments]
+            node_rows = np.asarray([0] + rows)
+            store = slot_trips[0].store
+            dist_matrix = distance_cache.matrix(np.r_[store.lat, table.lat[rows]], np.r_[store.lon, table.lon[rows]])
+            tours, node = [], 1
+            for trip in slot_trips:
+                tours.append([0] + list(range(node, node + len(trip.shipments))))
+                node += len(trip.shipments)
+            changed = improve_slot(
+                dist_matrix, tours,
+                lambda k, stops: trip_mst(slot_trips[k], table, node_rows[stops].tolist()),
+                deadline)
+            for k, mst_dist in changed.items():
+                trip = slot_trips[k]
+                trip.shipments = node_rows[tours[k][1:]].tolist()
+                trip.mst_dist = mst_dist
+                reorder_trip(trip, table, deadline)
+    return [trip for trip in trips if trip.shipments]
+
+def request_fleet(value=None):
+    # A request's "fleet" (dict or FleetConfig) -> FleetConfig
+    return DEFAULT_FLEET if value is None else fleet_config(value)
+
+def plan_groups(table, fleet, ordering):
+    # ({(store index, start, end): rows}, store index per row, distance from
+    # each row to its store). Shipments go to their nearest store; groups are
+    # store by store, each store's slots by start time and each slot ordered
+    # around its store
+    store_dist = np.stack([np.asarray(distance_cache.to_point(table.lat, table.lon, store.lat, store.lon))
+                           for store in fleet.stores])
+    store_of = store_dist.argmin(axis=0)
+    slots = timeslot_groups(table)
+    groups = {}
+    for s, store in enumerate(fleet.stores):
+        store_slots = {key: rows[store_of[rows] == s] for key, rows in slots.items()}
+        store_slots = {key: rows for key, rows in store_slots.items() if len(rows)}
+        for key, rows in order_groups(table, store_slots, store.location, ordering).items():
+            groups[(s,) + key] = rows
+    return groups, store_of.tolist(), store_dist[store_of, np.arange(len(table))]
+
+def prepare_distances(table, groups, fleet):
+    # Lets the distance provider measure each slot's shipments and store up
+    # front, before the slots are solved (possibly in other processes)
+    stores = fleet.stores
+    with phase('distances'):
+        distance_provider.prepare([(np.r_[stores[key[0]].lat, table.lat[rows]],
+                                    np.r_[stores[key[0]].lon, table.lon[rows]])
+                                   for key, rows in groups.items()])
+
+def plan_routes(shipments_data, parallel=False, progress=None, local_search=None, ordering=None, fleet=None):
+    if isinstance(shipments_data, ShipmentColumns):
+        table = shipments_data
+    else:
+        with phase('parse'):
+            table = read_records(shipments_data)
+    logger.info("Planning %d shipments", len(table))
+
+    fleet = request_fleet(fleet)
+    ordering = ordering or SLOT_ORDERING
+    fill = ordering == 'sweep'
+
+    with phase('group'):
+        groups, _, store_dist = plan_groups(table, fleet, ordering)
+    prepare_distances(table, groups, fleet)
+
+    # Stores are independent, each spending its own vehicles
+    trips = []
+    done = 0
+    for s, store in enumerate(fleet.stores):
+        vehicles = store.budget()
+        store_slots = {key[1:]: indices for key, indices in groups.items() if key[0] == s}
+        if parallel:
+            trips.extend(solve_timeslots_parallel(
+                table, store_slots, vehicles, fill=fill, store=store, fleet=fleet, store_dist=store_dist,
+                progress=progress and (lambda resolved, total, base=done: progress(base + resolved, len(groups)))))
+            done += len(store_slots)
+            continue
+        for (start_time, end_time), indices in store_slots.items():
+            trips.extend(solve_timeslot(start_time, end_time, indices, table.lat[indices], table.lon[indices],
+                                        vehicles, fill=fill, store=store, fleet=fleet, store_dist=store_dist[indices]))
+            done += 1
+            if progress:
+                progress(done, len(groups))
+
+    options = local_search_options(local_search)
+    if options:
+        trips = improve_trips(trips, table, options['budget'], options['inter_trip'])
+
+    metrics.inc('smartroute_shipments_total', len(table))
+    metrics.inc('smartroute_trips_total', len(trips))
+    return RoutePlan(table, trips, fleet)
+
+def optimize_routes(shipments_data, parallel=False, progress=None, local_search=None, ordering=None, fleet=None):
+    # Rows in the API's JSON/CSV format
+    return optimize_plan(shipments_data, parallel=parallel, progress=progress, local_search=local_search,
+                         ordering=ordering, fleet=fleet)[1]
+
+def optimize_plan(shipments_data, parallel=False, progress=None, local_search=None, ordering=None, fleet=None):
+    # (RoutePlan, output rows)
+    start = time.perf_counter()
+    route_plan = plan_routes(shipments_data, parallel=parallel, progress=progress, local_search=local_search,
+                             ordering=ordering, fleet=fleet)
+    with phase('output'):
+        output_data = route_plan.to_rows()
+    elapsed = time.perf_counter() - start
+    metrics.inc('smartroute_optimize_total')
+    metrics.observe('smartroute_optimize_seconds', elapsed)
+    logger.info("Planned %d trips for %d shipments in %.3fs", len(route_plan.trips), len(route_plan.shipments),
+                elapsed)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Output data: %s", output_data)
+    return route_plan, output_data
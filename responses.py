@@ -0,0 +1,219 @@
+# Response bodies for stored plans.
+#
+# The 'rows' view is the original format, one row per shipment with its
+# trip's fields repeated on every row. The 'trips' view sends each trip
+# once with its shipments nested under it. Either can be filtered by time
+# slot and vehicle type, paged and sent as one JSON document or streamed as
+# NDJSON, one row or trip per line.
+#
+# Pages end on trip boundaries. A cursor names the plan version and the
+# last trip of the page, so asking for the next page of a plan that has
+# changed since fails instead of skipping or repeating trips.
+#
+# Bodies are encoded with orjson when it is installed and compressed with
+# brotli (if installed) or gzip when the client accepts it.
+import base64
+import gzip
+import json
+import zlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from trip_store import PlanConflictError
+
+VIEWS = ('rows', 'trips')
+FORMATS = ('json', 'ndjson')
+
+# Row fields that belong to the shipment rather than the trip
+SHIPMENT_FIELDS = ('Shipment_ID', 'Latitude', 'Longitude')
+
+MAX_LIMIT = 10_000
+
+# Smaller JSON bodies are sent uncompressed
+COMPRESS_MIN_BYTES = 1024
+
+# Trips encoded per NDJSON chunk
+STREAM_BATCH = 64
+
+ENCODINGS = (('br',) if brotli else ()) + ('gzip',)
+
+
+def dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def encode_cursor(version, trip_id):
+    return base64.urlsafe_b64encode(f'{version}:{trip_id}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        version, trip_id = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split(':', 1)
+        return int(version), trip_id
+    except ValueError:
+        raise ValueError(f'Invalid cursor: {cursor!r}') from None
+
+
+def response_options(params):
+    # Query parameters -> options for plan_body; raises ValueError
+    view = params.get('view', 'rows')
+    if view not in VIEWS:
+        raise ValueError(f'view must be one of: {", ".join(VIEWS)}')
+    fmt = params.get('format', 'json')
+    if fmt not in FORMATS:
+        raise ValueError(f'format must be one of: {", ".join(FORMATS)}')
+    limit = params.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= MAX_LIMIT:
+            raise ValueError(f'limit must be between 1 and {MAX_LIMIT}')
+    return {
+        'view': view,
+        'format': fmt,
+        'slot': params.get('slot'),
+        'vehicle': params.get('vehicle'),
+        'limit': limit,
+        'cursor': params.get('cursor'),
+    }
+
+
+def is_legacy(options):
+    # The original response, a bare list of every row
+    return (options['view'] == 'rows' and options['format'] == 'json'
+            and all(options[key] is None for key in ('slot', 'vehicle', 'limit', 'cursor')))
+
+
+def select_trips(plan, slot=None, vehicle=None, limit=None, cursor=None):
+    # (trip ids of the page in plan order, cursor of the next page or None)
+    trip_ids = list(plan.by_trip)
+    if cursor is not None:
+        version, after = decode_cursor(cursor)
+        if version != plan.version:
+            raise PlanConflictError(f'Plan {plan.name!r} is at version {plan.version}, the cursor is for {version}')
+        try:
+            trip_ids = trip_ids[trip_ids.index(after) + 1:]
+        except ValueError:
+            raise ValueError(f'Invalid cursor: {cursor!r}') from None
+    for value, index in ((slot, plan.by_slot), (vehicle, plan.by_vehicle)):
+        if value is not None:
+            allowed = set(index.get(value, ()))
+            trip_ids = [trip_id for trip_id in trip_ids if trip_id in allowed]
+    if limit is None or len(trip_ids) <= limit:
+        return trip_ids, None
+    trip_ids = trip_ids[:limit]
+    return trip_ids, encode_cursor(plan.version, trip_ids[-1])
+
+
+def nest_trip(trip_rows):
+    trip = {key: value for key, value in trip_rows[0].items() if key not in SHIPMENT_FIELDS}
+    trip['shipments'] = [{key: row[key] for key in SHIPMENT_FIELDS if key in row} for row in trip_rows]
+    return trip
+
+
+def plan_items(plan, trip_ids, view):
+    # Rows or nested trips of the given trips, lazily
+    for trip_id in trip_ids:
+        trip_rows = plan.by_trip[trip_id]
+        if view == 'trips':
+            yield nest_trip(trip_rows)
+        else:
+            yield from trip_rows
+
+
+def accepted_encoding(accept_encoding):
+    # The preferred content coding of an Accept-Encoding header we support
+    offered = {}
+    for part in (accept_encoding or '').lower().split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        if params.strip().startswith('q='):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip()] = q
+    for encoding in ENCODINGS:
+        if offered.get(encoding, offered.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+def compress_stream(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=5)
+        for chunk in chunks:
+            out = compressor.process(chunk)
+            if out:
+                yield out
+        yield compressor.finish()
+        return
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def _ndjson(items):
+    batch = []
+    for item in items:
+        batch.append(dumps(item))
+        if len(batch) >= STREAM_BATCH:
+            yield b'\n'.join(batch) + b'\n'
+            batch = []
+    if batch:
+        yield b'\n'.join(batch) + b'\n'
+
+
+def plan_body(plan, options, accept_encoding=None):
+    # -> (body bytes or iterator of chunks, media type, headers)
+    encoding = accepted_encoding(accept_encoding)
+    headers = {'Vary': 'Accept-Encoding'}
+    if plan is not None:
+        headers['X-Plan-Version'] = str(plan.version)
+    if is_legacy(options):
+        body = dumps(plan.rows if plan is not None else [])
+        media_type = 'application/json'
+    else:
+        trip_ids, next_cursor = select_trips(plan, options['slot'], options['vehicle'], options['limit'],
+                                             options['cursor'])
+        items = plan_items(plan, trip_ids, options['view'])
+        if options['format'] == 'ndjson':
+            if next_cursor:
+                headers['X-Next-Cursor'] = next_cursor
+            chunks = _ndjson(items)
+            if encoding:
+                headers['Content-Encoding'] = encoding
+                chunks = compress_stream(chunks, encoding)
+            return chunks, 'application/x-ndjson', headers
+        body = dumps({
+            'plan': plan.name,
+            'version': plan.version,
+            options['view']: list(items),
+            'next_cursor': next_cursor,
+        })
+        media_type = 'application/json'
+    if encoding and len(body) >= COMPRESS_MIN_BYTES:
+        headers['Content-Encoding'] = encoding
+        body = compress(body, encoding)
+    return body, media_type, headers
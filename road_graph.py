@@ -0,0 +1,526 @@
+# Offline road network distances from an OpenStreetMap extract.
+#
+#   python road_graph.py mumbai.osm graphs/mumbai      # build once
+#
+# read_osm() takes the drivable ways of an OSM XML file (convert .pbf with
+# `osmium cat city.osm.pbf -o city.osm`) and keeps the largest connected
+# part of the network. Ways are treated as two-way, so distances are
+# symmetric like the rest of the planner assumes. build() contracts the
+# graph into a contraction hierarchy and saves it as .npy arrays.
+#
+# RoadGraph answers queries on the hierarchy: shortest road km between two
+# nodes meet at the highest-ranked node of both upward searches, many-to-
+# many tables use buckets of the targets' upward searches, and one-to-all
+# runs an upward search followed by one sweep down the ranks (PHAST).
+#
+# RoadDistances is the distance provider on top of a saved graph (see
+# distance.HaversineDistances for the interface). Points are snapped to the
+# nearest graph node and the straight-line snap is added at both ends.
+# prepare() measures each time slot's points once and writes the table to a
+# directory of .npy files; every process, the slot pool's workers included,
+# maps them read-only and only runs its own hierarchy queries on a miss.
+# Tables are written and pruned under a lock on the directory, so
+# concurrent jobs and batch workers can share it.
+import hashlib
+import heapq
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+from array import array
+from collections import OrderedDict
+
+import numpy as np
+
+from distance import haversine_pairs
+from distance_cache import point_keys
+from file_lock import locked
+from instrumentation import metrics
+from spatial_index import SpatialIndex
+
+logger = logging.getLogger('smartroute.roads')
+
+DRIVABLE = frozenset((
+    'motorway', 'motorway_link', 'trunk', 'trunk_link', 'primary', 'primary_link', 'secondary', 'secondary_link',
+    'tertiary', 'tertiary_link', 'unclassified', 'residential', 'living_street', 'service', 'road',
+))
+
+# Settled-node limit of the witness searches while contracting; a search
+# that gives up only costs a redundant shortcut
+WITNESS_SETTLE_LIMIT = 60
+
+# Upward search spaces kept per graph, for repeated point-to-point queries
+SEARCH_CACHE_SIZE = 4096
+
+# Points further than this from any road node are measured in a straight
+# line; they lie outside the extract
+MAX_SNAP_KM = 2.0
+
+# Largest slot table prepare() writes (km are float32, 16 MB at 2048
+# points), and the most tables kept in the directory
+MAX_TABLE_POINTS = 2048
+MAX_TABLES = 512
+
+# Misses from one point to at least this many others search the whole graph
+# once instead of pair by pair
+ONE_TO_ALL_MIN_POINTS = 256
+
+_ARRAYS = ('lat', 'lon', 'rank', 'up_start', 'up_target', 'up_weight')
+
+
+def read_osm(path):
+    # -> (lats, lons, edges) for the largest connected part of the drivable
+    # network; edges is an (m, 3) array of node index, node index, km
+    ids, lats, lons = array('q'), array('d'), array('d')
+    ways = []
+    for _, elem in ET.iterparse(path, events=('end',)):
+        if elem.tag == 'node':
+            ids.append(int(elem.get('id')))
+            lats.append(float(elem.get('lat')))
+            lons.append(float(elem.get('lon')))
+            elem.clear()
+        elif elem.tag == 'way':
+            tags = {tag.get('k'): tag.get('v') for tag in elem.iter('tag')}
+            if tags.get('highway') in DRIVABLE and tags.get('access') not in ('no', 'private'):
+                ways.append([int(nd.get('ref')) for nd in elem.iter('nd')])
+            elem.clear()
+        elif elem.tag == 'relation':
+            elem.clear()
+
+    ids = np.frombuffer(ids, dtype=np.int64)
+    order = np.argsort(ids, kind='stable')
+    sorted_ids = ids[order]
+    u, v = [], []
+    for refs in ways:
+        u.extend(refs[:-1])
+        v.extend(refs[1:])
+    u = np.asarray(u, dtype=np.int64)
+    v = np.asarray(v, dtype=np.int64)
+    # Drop segments to nodes the extract does not contain
+    pos_u = np.minimum(np.searchsorted(sorted_ids, u), len(sorted_ids) - 1)
+    pos_v = np.minimum(np.searchsorted(sorted_ids, v), len(sorted_ids) - 1)
+    ok = (sorted_ids[pos_u] == u) & (sorted_ids[pos_v] == v) & (u != v)
+    u, v = order[pos_u[ok]], order[pos_v[ok]]
+
+    used, inverse = np.unique(np.concatenate([u, v]), return_inverse=True)
+    u, v = inverse[:len(u)], inverse[len(u):]
+    keep = _largest_component(len(used), u, v)
+    remap = np.full(len(used), -1, dtype=np.int64)
+    remap[keep] = np.arange(int(keep.sum()))
+    in_part = keep[u]
+    u, v = remap[u[in_part]], remap[v[in_part]]
+    lats = np.frombuffer(lats, dtype=np.float64)[used[keep]]
+    lons = np.frombuffer(lons, dtype=np.float64)[used[keep]]
+    km = haversine_pairs(lats[u], lons[u], lats[v], lons[v])
+    return lats, lons, np.column_stack((u, v, km))
+
+
+def _largest_component(n, u, v):
+    parent = list(range(n))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for a, b in zip(u.tolist(), v.tolist()):
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[rb] = ra
+    roots = np.asarray([find(x) for x in range(n)], dtype=np.int64)
+    return roots == np.bincount(roots).argmax() if n else np.zeros(0, dtype=bool)
+
+
+def contract(n, edges):
+    # Contraction hierarchy of an undirected graph -> (rank, upward CSR
+    # arrays). Nodes are contracted in order of edge difference plus
+    # contracted neighbours, with lazy priority updates
+    adj = [{} for _ in range(n)]
+    for a, b, w in edges:
+        a, b = int(a), int(b)
+        if w < adj[a].get(b, float('inf')):
+            adj[a][b] = w
+            adj[b][a] = w
+    deleted = [0] * n
+
+    def witness(source, skip, limit, targets):
+        dist = {source: 0.0}
+        heap = [(0.0, source)]
+        remaining = set(targets)
+        settled = 0
+        while heap and remaining:
+            d, x = heapq.heappop(heap)
+            if d > dist[x]:
+                continue
+            if d > limit or settled >= WITNESS_SETTLE_LIMIT:
+                break
+            remaining.discard(x)
+            settled += 1
+            for y, w in adj[x].items():
+                if y != skip and d + w < dist.get(y, float('inf')):
+                    dist[y] = d + w
+                    heapq.heappush(heap, (d + w, y))
+        return dist
+
+    def shortcuts(v):
+        neighbors = list(adj[v].items())
+        needed = []
+        for i, (a, wa) in enumerate(neighbors[:-1]):
+            targets = [(b, wa + wb) for b, wb in neighbors[i + 1:]]
+            dist = witness(a, v, max(d for _, d in targets), [b for b, _ in targets])
+            needed.extend((a, b, d) for b, d in targets if dist.get(b, float('inf')) > d)
+        return needed
+
+    def priority(v, needed):
+        return len(needed) - len(adj[v]) + deleted[v]
+
+    queue = [(priority(v, shortcuts(v)), v) for v in range(n)]
+    heapq.heapify(queue)
+    rank = [0] * n
+    up = [None] * n
+    started = time.perf_counter()
+    for r in range(n):
+        while True:
+            _, v = heapq.heappop(queue)
+            needed = shortcuts(v)
+            p = priority(v, needed)
+            if not queue or p <= queue[0][0]:
+                break
+            heapq.heappush(queue, (p, v))
+        rank[v] = r
+        up[v] = adj[v]
+        for a, b, d in needed:
+            if d < adj[a].get(b, float('inf')):
+                adj[a][b] = d
+                adj[b][a] = d
+        for a in adj[v]:
+            del adj[a][v]
+            deleted[a] += 1
+        adj[v] = {}
+        if r and r % 10000 == 0:
+            logger.info("Contracted %d/%d nodes in %.0fs", r, n, time.perf_counter() - started)
+
+    up_start = np.zeros(n + 1, dtype=np.int64)
+    up_start[1:] = np.cumsum([len(edges) for edges in up])
+    up_target = np.fromiter((b for edges in up for b in edges), dtype=np.int64, count=int(up_start[-1]))
+    up_weight = np.fromiter((w for edges in up for w in edges.values()), dtype=np.float64, count=int(up_start[-1]))
+    return np.asarray(rank, dtype=np.int64), up_start, up_target, up_weight
+
+
+def build(osm_path, directory):
+    # Parse, contract and save; returns the RoadGraph
+    started = time.perf_counter()
+    lats, lons, edges = read_osm(osm_path)
+    logger.info("Read %d nodes and %d road segments", len(lats), len(edges))
+    rank, up_start, up_target, up_weight = contract(len(lats), edges)
+    graph = RoadGraph(lats, lons, rank, up_start, up_target, up_weight)
+    graph.save(directory, source=os.path.basename(osm_path))
+    logger.info("Built road graph in %.1fs", time.perf_counter() - started)
+    return graph
+
+
+class RoadGraph:
+    def __init__(self, lat, lon, rank, up_start, up_target, up_weight, name=None):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.rank = np.asarray(rank, dtype=np.int64)
+        self.name = name
+        self.arrays = (self.rank, np.asarray(up_start), np.asarray(up_target), np.asarray(up_weight))
+        self.searches = OrderedDict()
+        self._up = None
+        self._down_order = None
+
+    def __len__(self):
+        return len(self.lat)
+
+    def upward_edges(self):
+        # Searches walk plain lists, which index far faster than arrays;
+        # built on first use so processes that only read tables skip them
+        if self._up is None:
+            self._up = tuple(values.tolist() for values in self.arrays[1:])
+        return self._up
+
+    def save(self, directory, source=None):
+        os.makedirs(directory, exist_ok=True)
+        for name, values in zip(_ARRAYS, (self.lat, self.lon) + self.arrays):
+            np.save(os.path.join(directory, f'{name}.npy'), values)
+        with open(os.path.join(directory, 'graph.json'), 'w') as f:
+            json.dump({'source': source, 'nodes': len(self), 'edges': len(self.arrays[2])}, f)
+
+    @classmethod
+    def load(cls, directory):
+        arrays = [np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r') for name in _ARRAYS]
+        return cls(*arrays, name=os.path.basename(os.path.normpath(directory)))
+
+    def upward(self, node):
+        # {node: km} of everything the upward search from node settles
+        space = self.searches.get(node)
+        if space is not None:
+            self.searches.move_to_end(node)
+            return space
+        start, target, weight = self.upward_edges()
+        dist = {node: 0.0}
+        space = {}
+        heap = [(0.0, node)]
+        while heap:
+            d, x = heapq.heappop(heap)
+            if x in space:
+                continue
+            space[x] = d
+            for i in range(start[x], start[x + 1]):
+                y = target[i]
+                nd = d + weight[i]
+                if nd < dist.get(y, float('inf')):
+                    dist[y] = nd
+                    heapq.heappush(heap, (nd, y))
+        self.searches[node] = space
+        if len(self.searches) > SEARCH_CACHE_SIZE:
+            self.searches.popitem(last=False)
+        return space
+
+    def distance(self, a, b):
+        if a == b:
+            return 0.0
+        space_a, space_b = self.upward(a), self.upward(b)
+        if len(space_b) < len(space_a):
+            space_a, space_b = space_b, space_a
+        return min((d + space_b[x] for x, d in space_a.items() if x in space_b), default=float('inf'))
+
+    def many_to_many(self, sources, targets):
+        # (len(sources), len(targets)) km matrix
+        buckets = {}
+        for j, node in enumerate(targets):
+            for x, d in self.upward(node).items():
+                buckets.setdefault(x, ([], []))
+                buckets[x][0].append(j)
+                buckets[x][1].append(d)
+        buckets = {x: (np.asarray(js), np.asarray(ds)) for x, (js, ds) in buckets.items()}
+        out = np.full((len(sources), len(targets)), np.inf)
+        for i, node in enumerate(sources):
+            row = out[i]
+            for x, d in self.upward(node).items():
+                bucket = buckets.get(x)
+                if bucket is not None:
+                    js, ds = bucket
+                    np.minimum.at(row, js, ds + d)
+        return out
+
+    def one_to_all(self, node):
+        # km from node to every node, by an upward search and then one pass
+        # over the nodes from the highest rank down
+        if self._down_order is None:
+            self._down_order = np.argsort(self.rank)[::-1].tolist()
+        dist = [float('inf')] * len(self)
+        for x, d in self.upward(node).items():
+            dist[x] = d
+        start, target, weight = self.upward_edges()
+        for v in self._down_order:
+            best = dist[v]
+            for i in range(start[v], start[v + 1]):
+                d = dist[target[i]] + weight[i]
+                if d < best:
+                    best = d
+            dist[v] = best
+        return np.asarray(dist)
+
+
+class RoadDistances:
+    def __init__(self, graph_dir, table_dir=None):
+        self.graph = RoadGraph.load(graph_dir)
+        self.name = f'road-{self.graph.name}'
+        self.table_dir = table_dir or os.path.join(graph_dir, 'tables')
+        self.index = None
+        self.snaps = {}
+        self.lock = threading.RLock()
+        self.tables = []
+        self.located = {}
+        self.scanned = None
+
+    def _snap(self, lats, lons):
+        # (graph node, km to it) per point; node -1 if no road is near
+        keys = point_keys(lats, lons).tolist()
+        with self.lock:
+            if self.index is None:
+                self.index = SpatialIndex(self.graph.lat, self.graph.lon)
+            nodes, km = [], []
+            for key, lat, lon in zip(keys, np.asarray(lats).tolist(), np.asarray(lons).tolist()):
+                snap = self.snaps.get(key)
+                if snap is None:
+                    d, node = self.index.nearest(lat, lon)[0]
+                    snap = self.snaps[key] = (node, d) if d <= MAX_SNAP_KM else (-1, 0.0)
+                nodes.append(snap[0])
+                km.append(snap[1])
+        return np.asarray(nodes, dtype=np.int64), np.asarray(km)
+
+    def _road(self, nodes_a, snap_a, nodes_b, snap_b, lats_a, lons_a, lats_b, lons_b, road):
+        # Snap, road, snap; straight line where either end is off the graph
+        # or the road km is unknown (inf)
+        km = snap_a + road + snap_b
+        off = (nodes_a < 0) | (nodes_b < 0) | ~np.isfinite(km)
+        if off.any():
+            km[off] = haversine_pairs(lats_a[off], lons_a[off], lats_b[off], lons_b[off])
+        return km
+
+    def to_point(self, lats, lons, lat, lon):
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        return self.pairs(lats, lons, np.full(lats.size, lat), np.full(lons.size, lon))
+
+    def pairs(self, lats_a, lons_a, lats_b, lons_b):
+        lats_a, lons_a, lats_b, lons_b = (np.asarray(v, dtype=np.float64).ravel()
+                                          for v in (lats_a, lons_a, lats_b, lons_b))
+        keys_a, keys_b = point_keys(lats_a, lons_a), point_keys(lats_b, lons_b)
+        km = self._from_tables(keys_a, keys_b)
+        # The same point is 0 km from itself, as on a table's diagonal, not
+        # twice its snap
+        km[keys_a == keys_b] = 0
+        missing = np.flatnonzero(np.isnan(km))
+        if missing.size:
+            nodes_a, snap_a = self._snap(lats_a[missing], lons_a[missing])
+            nodes_b, snap_b = self._snap(lats_b[missing], lons_b[missing])
+            road = np.full(missing.size, np.inf)
+            on = np.flatnonzero((nodes_a >= 0) & (nodes_b >= 0))
+            metrics.inc('smartroute_road_pairs_total', on.size)
+            with self.lock:
+                sources = np.unique(nodes_b[on])
+                if sources.size == 1 and on.size >= ONE_TO_ALL_MIN_POINTS:
+                    road[on] = self.graph.one_to_all(int(sources[0]))[nodes_a[on]]
+                else:
+                    for i, a, b in zip(on.tolist(), nodes_a[on].tolist(), nodes_b[on].tolist()):
+                        road[i] = self.graph.distance(a, b)
+            km[missing] = self._road(nodes_a, snap_a, nodes_b, snap_b, lats_a[missing], lons_a[missing],
+                                     lats_b[missing], lons_b[missing], road)
+        return km
+
+    def rect(self, lats_a, lons_a, lats_b, lons_b):
+        lats_a, lons_a, lats_b, lons_b = (np.asarray(v, dtype=np.float64).ravel()
+                                          for v in (lats_a, lons_a, lats_b, lons_b))
+        rows = np.repeat(np.arange(lats_a.size), lats_b.size)
+        cols = np.tile(np.arange(lats_b.size), lats_a.size)
+        keys_a, keys_b = point_keys(lats_a, lons_a)[rows], point_keys(lats_b, lons_b)[cols]
+        km = self._from_tables(keys_a, keys_b)
+        km[keys_a == keys_b] = 0
+        if np.isnan(km).any():
+            nodes_a, snap_a = self._snap(lats_a, lons_a)
+            nodes_b, snap_b = self._snap(lats_b, lons_b)
+            metrics.inc('smartroute_road_pairs_total', km.size)
+            with self.lock:
+                road = self.graph.many_to_many(np.maximum(nodes_a, 0).tolist(), np.maximum(nodes_b, 0).tolist())
+            fresh = self._road(nodes_a[rows], snap_a[rows], nodes_b[cols], snap_b[cols], lats_a[rows],
+                               lons_a[rows], lats_b[cols], lons_b[cols], road.ravel())
+            km = np.where(np.isnan(km), fresh, km)
+        return km.reshape(lats_a.size, lats_b.size)
+
+    def prepare(self, point_sets):
+        # Writes the distance table of every (lats, lons) set that has none
+        # yet, for all processes to read
+        os.makedirs(self.table_dir, exist_ok=True)
+        written = 0
+        for lats, lons in point_sets:
+            keys, first = np.unique(point_keys(lats, lons), return_index=True)
+            if keys.size < 2 or keys.size > MAX_TABLE_POINTS:
+                continue
+            name = hashlib.sha1(keys.tobytes()).hexdigest()[:20]
+            path = os.path.join(self.table_dir, name)
+            if os.path.exists(path + '.keys.npy'):
+                continue
+            lats = np.asarray(lats, dtype=np.float64)[first]
+            lons = np.asarray(lons, dtype=np.float64)[first]
+            km = self.rect(lats, lons, lats, lons).astype(np.float32)
+            np.fill_diagonal(km, 0)
+            with locked(os.path.join(self.table_dir, 'tables.lock')):
+                # Another process may have measured the same points meanwhile
+                if os.path.exists(path + '.keys.npy'):
+                    continue
+                # The keys file marks a complete table, so it goes last
+                for suffix, values in (('.km.npy', km), ('.keys.npy', keys)):
+                    fd, tmp_path = tempfile.mkstemp(dir=self.table_dir, prefix=name + '.', suffix='.tmp')
+                    try:
+                        with os.fdopen(fd, 'wb') as f:
+                            np.save(f, values)
+                        os.replace(tmp_path, path + suffix)
+                    except BaseException:
+                        os.unlink(tmp_path)
+                        raise
+            written += 1
+            metrics.inc('smartroute_road_tables_total')
+        if written:
+            with locked(os.path.join(self.table_dir, 'tables.lock')):
+                self._prune()
+        return written
+
+    def _prune(self):
+        names = sorted((entry.stat().st_mtime, entry.path[:-len('.keys.npy')])
+                       for entry in os.scandir(self.table_dir) if entry.name.endswith('.keys.npy'))
+        for _, path in names[:-MAX_TABLES]:
+            for suffix in ('.keys.npy', '.km.npy'):
+                try:
+                    os.remove(path + suffix)
+                except FileNotFoundError:
+                    pass
+
+    def _scan(self):
+        # Maps the tables in the directory, again whenever it has changed
+        try:
+            stamp = os.stat(self.table_dir).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if stamp == self.scanned:
+            return
+        tables, located = [], {}
+        for entry in sorted(os.scandir(self.table_dir), key=lambda entry: entry.name):
+            if not entry.name.endswith('.keys.npy'):
+                continue
+            path = entry.path[:-len('.keys.npy')]
+            try:
+                keys = np.load(path + '.keys.npy')
+                km = np.load(path + '.km.npy', mmap_mode='r')
+            except (OSError, ValueError):
+                # Pruned by another process meanwhile
+                continue
+            t = len(tables)
+            tables.append(km)
+            for pos, key in enumerate(keys.tolist()):
+                located.setdefault(key, {})[t] = pos
+        self.tables, self.located, self.scanned = tables, located, stamp
+
+    def _from_tables(self, keys_a, keys_b):
+        # km per pair from the prepared tables, NaN where none has both points
+        out = np.full(len(keys_a), np.nan)
+        with self.lock:
+            self._scan()
+            tables, located = self.tables, self.located
+        if not tables:
+            return out
+        hits = {}
+        for i, (a, b) in enumerate(zip(keys_a.tolist(), keys_b.tolist())):
+            in_a = located.get(a)
+            in_b = located.get(b) if in_a else None
+            if not in_b:
+                continue
+            if len(in_b) < len(in_a):
+                # Tables are symmetric
+                in_a, in_b = in_b, in_a
+            for t, pos in in_a.items():
+                other = in_b.get(t)
+                if other is not None:
+                    hit = hits.setdefault(t, ([], [], []))
+                    hit[0].append(i)
+                    hit[1].append(pos)
+                    hit[2].append(other)
+                    break
+        for t, (idx, rows, cols) in hits.items():
+            out[idx] = tables[t][rows, cols]
+        return out
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('usage: python road_graph.py EXTRACT.osm OUTPUT_DIR')
+    logging.basicConfig(level=os.environ.get('SMARTROUTE_LOG_LEVEL', 'INFO'))
+    build(sys.argv[1], sys.argv[2])
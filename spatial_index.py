@@ -0,0 +1,167 @@
+# k-d tree over shipment coordinates.
+#
+# Points are stored as 3D unit vectors, where straight-line (chord) distance
+# grows monotonically with great-circle distance, so nearest-neighbour order
+# and radius membership are exact with respect to haversine. Points can be
+# removed after they are visited; a node whose points are all removed is
+# skipped entirely by later queries.
+import heapq
+import math
+
+import numpy as np
+
+from distance import EARTH_RADIUS_KM, haversine_to_point
+
+
+def _unit_vectors(lats, lons):
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    lon = np.radians(np.asarray(lons, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+class SpatialIndex:
+    def __init__(self, lats, lons, leaf_size=16):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.xyz = _unit_vectors(self.lats, self.lons)
+        n = len(self.lats)
+        self.alive = np.ones(n, dtype=bool)
+        self.count = n
+
+        # Node arrays; a leaf has children None and members set
+        self.box_lo = []
+        self.box_hi = []
+        self.children = []
+        self.members = []
+        self.live = []
+        self.parent = []
+        self.leaf_of = np.zeros(n, dtype=np.int64)
+
+        stack = [(np.arange(n), -1, None)]
+        while stack:
+            idx, parent, side = stack.pop()
+            node = len(self.children)
+            pts = self.xyz[idx]
+            lo = pts.min(axis=0) if idx.size else np.zeros(3)
+            hi = pts.max(axis=0) if idx.size else np.zeros(3)
+            self.box_lo.append(lo.tolist())
+            self.box_hi.append(hi.tolist())
+            self.live.append(int(idx.size))
+            self.parent.append(parent)
+            self.children.append(None)
+            self.members.append(None)
+            if parent >= 0:
+                left, right = self.children[parent]
+                self.children[parent] = (node, right) if side == 0 else (left, node)
+
+            if idx.size <= leaf_size:
+                self.members[node] = idx
+                self.leaf_of[idx] = node
+                continue
+            axis = int(np.argmax(hi - lo))
+            order = idx[np.argsort(pts[:, axis], kind='stable')]
+            mid = order.size // 2
+            self.children[node] = (-1, -1)
+            stack.append((order[mid:], node, 1))
+            stack.append((order[:mid], node, 0))
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, i):
+        return bool(self.alive[i])
+
+    def remove(self, i):
+        if not self.alive[i]:
+            return
+        self.alive[i] = False
+        self.count -= 1
+        node = int(self.leaf_of[i])
+        while node >= 0:
+            self.live[node] -= 1
+            node = self.parent[node]
+
+    def _box_dist2(self, node, q):
+        lo = self.box_lo[node]
+        hi = self.box_hi[node]
+        d2 = 0.0
+        for axis in range(3):
+            v = q[axis]
+            if v < lo[axis]:
+                d2 += (lo[axis] - v) ** 2
+            elif v > hi[axis]:
+                d2 += (v - hi[axis]) ** 2
+        return d2
+
+    def _leaf_dist2(self, node, q):
+        idx = self.members[node]
+        idx = idx[self.alive[idx]]
+        diff = self.xyz[idx] - q
+        return idx, np.einsum('ij,ij->i', diff, diff)
+
+    def nearest(self, lat, lon, k=1):
+        # [(km, index), ...] for the k closest live points, ties by index
+        if self.count == 0 or k <= 0:
+            return []
+        q = _unit_vectors(lat, lon)[0]
+        ql = q.tolist()
+        best = []  # max-heap of (-d2, -index)
+        frontier = [(0.0, 0)]
+        while frontier:
+            box_d2, node = heapq.heappop(frontier)
+            if len(best) == k and box_d2 > -best[0][0]:
+                break
+            if self.live[node] == 0:
+                continue
+            if self.children[node] is None:
+                idx, d2 = self._leaf_dist2(node, q)
+                for i, d in zip(idx.tolist(), d2.tolist()):
+                    item = (-d, -i)
+                    if len(best) < k:
+                        heapq.heappush(best, item)
+                    elif item > best[0]:
+                        heapq.heapreplace(best, item)
+                continue
+            for child in self.children[node]:
+                if self.live[child]:
+                    heapq.heappush(frontier, (self._box_dist2(child, ql), child))
+
+        found = sorted((-d, -i) for d, i in best)
+        indices = [i for _, i in found]
+        km = haversine_to_point(self.lats[indices], self.lons[indices], lat, lon)
+        return list(zip(km.tolist(), indices))
+
+    def pop_nearest(self, lat, lon):
+        # Nearest live point, removed from the index (delete-on-visit)
+        found = self.nearest(lat, lon)
+        if not found:
+            return None
+        self.remove(found[0][1])
+        return found[0]
+
+    def within_radius(self, lat, lon, radius_km):
+        # Sorted indices of live points within radius_km of (lat, lon)
+        if self.count == 0:
+            return []
+        q = _unit_vectors(lat, lon)[0]
+        ql = q.tolist()
+        angle = min(radius_km / EARTH_RADIUS_KM, math.pi)
+        # Slightly loose chord bound; candidates are re-checked with haversine
+        limit2 = (2 * math.sin(angle / 2) * (1 + 1e-9)) ** 2
+        candidates = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if self.live[node] == 0 or self._box_dist2(node, ql) > limit2:
+                continue
+            if self.children[node] is None:
+                idx, d2 = self._leaf_dist2(node, q)
+                candidates.append(idx[d2 <= limit2])
+            else:
+                stack.extend(self.children[node])
+        if not candidates:
+            return []
+        idx = np.sort(np.concatenate(candidates))
+        km = haversine_to_point(self.lats[idx], self.lons[idx], lat, lon)
+        return idx[km <= radius_km].tolist()
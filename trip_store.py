@@ -0,0 +1,194 @@
+# In-memory store of optimized plans.
+#
+# Each named plan keeps its output rows plus indexes by TRIP_ID, TIME_SLOT
+# and Vehicle_Type, so API lookups never touch the disk. Plans are persisted
+# as column arrays in a compressed .npz file by a background writer; only
+# the newest version of a plan is written if several are queued.
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from ingest import ShipmentColumns
+
+DEFAULT_PLAN = 'default'
+
+# Plan names double as file names
+_PLAN_NAME = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+# Numeric columns may hold 'N/A' (COV_UTI of unlimited-radius vehicles);
+# it is stored as NaN plus a marker array
+_NA_TOKEN = 'N/A'
+_NA_SUFFIX = '__na'
+
+# The shipment table a plan was solved from is saved with its rows under
+# this prefix, for incremental re-planning
+_SHIPMENTS_PREFIX = 'shipments__'
+
+# ... and the fleet configuration it was planned with, as JSON
+_FLEET_KEY = 'fleet__json'
+
+# ... and its version, so versions and cursors held by clients stay valid
+# across restarts
+_VERSION_KEY = 'version__'
+
+
+class PlanConflictError(Exception):
+    pass
+
+
+def is_valid_plan_name(name):
+    return isinstance(name, str) and bool(_PLAN_NAME.match(name))
+
+
+class Plan:
+    __slots__ = ('name', 'version', 'rows', 'shipments', 'fleet', 'by_trip', 'by_slot', 'by_vehicle')
+
+    def __init__(self, name, version, rows, shipments=None, fleet=None):
+        self.name = name
+        self.version = version
+        self.rows = rows
+        self.shipments = shipments
+        self.fleet = fleet
+        self.by_trip = {}
+        self.by_slot = {}
+        self.by_vehicle = {}
+        for row in rows:
+            self.by_trip.setdefault(row['TRIP_ID'], []).append(row)
+        for trip_id, trip_rows in self.by_trip.items():
+            first = trip_rows[0]
+            self.by_slot.setdefault(first.get('TIME_SLOT'), []).append(trip_id)
+            self.by_vehicle.setdefault(first.get('Vehicle_Type'), []).append(trip_id)
+
+    def trip(self, trip_id):
+        return self.by_trip.get(trip_id, [])
+
+
+def _encode_columns(rows):
+    columns = {}
+    for name in (rows[0].keys() if rows else []):
+        values = [row.get(name) for row in rows]
+        numeric = [isinstance(v, (int, float)) and not isinstance(v, bool) for v in values]
+        if all(numeric):
+            columns[name] = np.asarray(values)
+        elif all(n or v == _NA_TOKEN for v, n in zip(values, numeric)):
+            columns[name] = np.asarray([v if n else np.nan for v, n in zip(values, numeric)], dtype=np.float64)
+            columns[name + _NA_SUFFIX] = np.asarray([True])
+        else:
+            columns[name] = np.asarray([str(v) for v in values])
+    return columns
+
+
+def _encode_shipments(table):
+    ids = table.ids
+    if all(isinstance(v, int) and not isinstance(v, bool) for v in ids):
+        ids = np.asarray(ids, dtype=np.int64)
+    else:
+        ids = np.asarray([str(v) for v in ids])
+    return {
+        _SHIPMENTS_PREFIX + 'ids': ids,
+        _SHIPMENTS_PREFIX + 'lat': table.lat,
+        _SHIPMENTS_PREFIX + 'lon': table.lon,
+        _SHIPMENTS_PREFIX + 'start': table.start,
+        _SHIPMENTS_PREFIX + 'end': table.end,
+    }
+
+
+def _decode_shipments(data):
+    if _SHIPMENTS_PREFIX + 'ids' not in data.files:
+        return None
+    ids, lat, lon, start, end = (data[_SHIPMENTS_PREFIX + name] for name in ('ids', 'lat', 'lon', 'start', 'end'))
+    return ShipmentColumns(ids.tolist(), lat, lon, start, end)
+
+
+def _decode_version(data):
+    # Files written before versions were saved start at 1
+    return int(data[_VERSION_KEY]) if _VERSION_KEY in data.files else 1
+
+
+def _decode_fleet(data):
+    return json.loads(data[_FLEET_KEY].item()) if _FLEET_KEY in data.files else None
+
+
+def _decode_columns(data):
+    names = [name for name in data.files
+             if not name.endswith(_NA_SUFFIX) and not name.startswith(_SHIPMENTS_PREFIX)
+             and name not in (_FLEET_KEY, _VERSION_KEY)]
+    columns = {}
+    for name in names:
+        values = data[name].tolist()
+        if name + _NA_SUFFIX in data.files:
+            values = [_NA_TOKEN if v != v else v for v in values]
+        columns[name] = values
+    n = len(columns[names[0]]) if names else 0
+    return [{name: columns[name][i] for name in names} for i in range(n)]
+
+
+class TripStore:
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.plans = {}
+        self.lock = threading.Lock()
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='smartroute-store')
+        self.pending = []
+
+    def _path(self, name):
+        return os.path.join(self.directory, f'{name}.npz')
+
+    def put(self, name, rows, shipments=None, fleet=None):
+        # fleet is the plan's configuration as a JSON-able dict
+        if not is_valid_plan_name(name):
+            raise ValueError(f'Invalid plan name: {name!r}')
+        # A plan only on disk so far is replaced by its next version too
+        self.get(name)
+        with self.lock:
+            self.pending = [f for f in self.pending if not f.done()]
+            previous = self.plans.get(name)
+            plan = Plan(name, previous.version + 1 if previous else 1, rows, shipments, fleet)
+            self.plans[name] = plan
+            if self.directory:
+                self.pending.append(self.writer.submit(self._persist, plan))
+        return plan
+
+    def get(self, name=DEFAULT_PLAN):
+        plan = self.plans.get(name)
+        if plan is None and self.directory and is_valid_plan_name(name) and os.path.exists(self._path(name)):
+            # Cold start only; afterwards the plan is served from memory
+            with np.load(self._path(name)) as data:
+                rows = _decode_columns(data)
+                shipments = _decode_shipments(data)
+                fleet = _decode_fleet(data)
+                version = _decode_version(data)
+            with self.lock:
+                plan = self.plans.setdefault(name, Plan(name, version, rows, shipments, fleet))
+        return plan
+
+    def names(self):
+        names = set(self.plans)
+        if self.directory and os.path.isdir(self.directory):
+            names.update(f[:-4] for f in os.listdir(self.directory) if f.endswith('.npz'))
+        return sorted(names)
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for future in pending:
+            future.result()
+
+    def _persist(self, plan):
+        if self.plans.get(plan.name) is not plan:
+            return  # superseded by a newer version
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self._path(plan.name) + '.tmp'
+        columns = _encode_columns(plan.rows)
+        columns[_VERSION_KEY] = np.asarray(plan.version)
+        if plan.shipments is not None:
+            columns.update(_encode_shipments(plan.shipments))
+        if plan.fleet is not None:
+            columns[_FLEET_KEY] = np.asarray(json.dumps(plan.fleet))
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **columns)
+        os.replace(tmp_path, self._path(plan.name))